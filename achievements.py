@@ -0,0 +1,70 @@
+from typing import Dict, Iterable, List, NamedTuple
+
+from cards import CARD_BITS, CARDS, CARDS_BY_RARITY, RARITIES
+from config import ACHIEVEMENT_XP
+
+class Achievement(NamedTuple):
+    """Достижение за сбор набора карточек"""
+    key: str
+    title: str
+    mask: int            # Биты карточек набора
+    size: int            # Количество карточек в наборе
+    xp: int
+
+def cards_mask(card_names: Iterable[str]) -> int:
+    """Битовая маска набора карточек"""
+    mask = 0
+    for card_name in card_names:
+        mask |= 1 << CARD_BITS[card_name]
+    return mask
+
+def build_achievements() -> Dict[str, Achievement]:
+    """Собрать достижения: все карточки каждой редкости и весь каталог"""
+    achievements = {}
+    for rarity, info in RARITIES.items():
+        if not CARDS_BY_RARITY[rarity]:
+            continue
+        mask = cards_mask(CARDS_BY_RARITY[rarity])
+        achievements[rarity] = Achievement(
+            key=rarity,
+            title=f"Все карточки {info.label}",
+            mask=mask,
+            size=mask.bit_count(),
+            xp=ACHIEVEMENT_XP.get(rarity, 0)
+        )
+
+    mask = cards_mask(CARDS)
+    achievements["all"] = Achievement(
+        key="all",
+        title="👑 Вся коллекция",
+        mask=mask,
+        size=mask.bit_count(),
+        xp=ACHIEVEMENT_XP.get("all", 0)
+    )
+    return achievements
+
+ACHIEVEMENTS = build_achievements()
+
+def bits_from_bytes(data: bytes) -> int:
+    """Битовый набор из значения колонки BLOB"""
+    return int.from_bytes(data, "little") if data else 0
+
+def bits_to_bytes(bits: int) -> bytes:
+    """Битовый набор в значение колонки BLOB"""
+    return bits.to_bytes((bits.bit_length() + 7) // 8 or 1, "little")
+
+def completed(bits: int) -> List[Achievement]:
+    """Все собранные наборы"""
+    return [a for a in ACHIEVEMENTS.values() if bits & a.mask == a.mask]
+
+def newly_completed(old_bits: int, new_bits: int) -> List[Achievement]:
+    """Наборы, которые собрались при переходе old_bits -> new_bits"""
+    added = new_bits & ~old_bits
+    return [
+        a for a in ACHIEVEMENTS.values()
+        if added & a.mask and new_bits & a.mask == a.mask
+    ]
+
+def progress(bits: int) -> List[tuple]:
+    """Прогресс по каждому набору: (достижение, собрано карточек)"""
+    return [(a, (bits & a.mask).bit_count()) for a in ACHIEVEMENTS.values()]
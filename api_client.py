@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+from http import HTTPStatus
+from typing import Optional, Tuple
+
+import httpx
+from telegram.error import NetworkError, TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+from diagnostics import measure
+
+logger = logging.getLogger(__name__)
+
+# Пул для обычных запросов (сообщения, ответы на кнопки, inline-результаты)
+TEXT_POOL_SIZE = 256
+TEXT_TIMEOUTS = {"connect_timeout": 5.0, "read_timeout": 10.0, "write_timeout": 5.0, "pool_timeout": 3.0}
+
+# Отдельный пул для загрузки анимаций: долгие загрузки не занимают соединения текстовых запросов
+MEDIA_POOL_SIZE = 16
+MEDIA_TIMEOUTS = {"connect_timeout": 5.0, "read_timeout": 60.0, "write_timeout": 60.0, "pool_timeout": 30.0}
+
+# Сколько раз повторять запрос после ошибки сети или ответа 429/5xx
+MAX_RETRIES = 3
+
+# Ошибки, при которых запрос точно не дошёл до Telegram
+NOT_SENT_ERRORS = (httpx.ConnectTimeout, httpx.PoolTimeout, httpx.ConnectError)
+
+# Экспоненциальная пауза между повторами после ошибок сети (в секундах)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+# Если Telegram просит подождать дольше, ошибка RetryAfter уходит вызывающему коду
+MAX_RETRY_AFTER = 60
+
+class ApiRequest(HTTPXRequest):
+    """Сетевой слой бота: два пула соединений и повтор запросов.
+
+    Собственный клиент HTTPXRequest обслуживает текстовые запросы, а запросы
+    с файлами идут через отдельный пул для загрузок. Ответ 429 повторяется
+    через указанное Telegram время retry_after: такой запрос отклонён до
+    обработки. Ошибки, при которых запрос не был отправлен, повторяются с
+    экспоненциальной паузой. После таймаута чтения и ответа 5xx повторяются
+    только методы get*: сообщение могло уже дойти, и повтор отправил бы его
+    дважды. Время запросов (вместе с повторами) учитывается в диагностике
+    как шаг telegram.
+    """
+
+    def __init__(self, max_retries: int = MAX_RETRIES):
+        super().__init__(connection_pool_size=TEXT_POOL_SIZE, **TEXT_TIMEOUTS)
+        self.max_retries = max_retries
+        self._media = HTTPXRequest(connection_pool_size=MEDIA_POOL_SIZE, **MEDIA_TIMEOUTS)
+
+    async def initialize(self):
+        await super().initialize()
+        await self._media.initialize()
+
+    async def shutdown(self):
+        await super().shutdown()
+        await self._media.shutdown()
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        if request_data and request_data.contains_files:
+            do_request = self._media.do_request
+            # HTTPXRequest сам ставит загрузкам 20 секунд, если таймаут не задан явно
+            if write_timeout is BaseRequest.DEFAULT_NONE:
+                write_timeout = MEDIA_TIMEOUTS["write_timeout"]
+        else:
+            do_request = super().do_request
+
+        with measure("telegram"):
+            for attempt in range(self.max_retries + 1):
+                last_attempt = attempt == self.max_retries
+                try:
+                    code, payload = await do_request(
+                        url, method, request_data,
+                        read_timeout=read_timeout,
+                        write_timeout=write_timeout,
+                        connect_timeout=connect_timeout,
+                        pool_timeout=pool_timeout
+                    )
+                except (TimedOut, NetworkError) as e:
+                    if last_attempt or not (is_not_sent(e) or is_read_only(url)):
+                        raise
+                    delay = backoff(attempt)
+                    logger.warning(f"Ошибка сети ({e}), повтор через {delay:.1f}с")
+                else:
+                    delay = retry_delay(code, payload, attempt, is_read_only(url))
+                    if delay is None or last_attempt:
+                        return code, payload
+                    logger.warning(f"Telegram ответил {code}, повтор через {delay:.1f}с")
+                await asyncio.sleep(delay)
+
+def is_not_sent(error: NetworkError) -> bool:
+    """Запрос точно не дошёл до Telegram (не удалось подключиться или занять соединение)"""
+    return isinstance(error.__cause__, NOT_SENT_ERRORS)
+
+def is_read_only(url: str) -> bool:
+    """Метод только читает данные (getMe, getFile и т.п.), его можно повторить в любом случае"""
+    return url.rsplit("/", 1)[-1].startswith("get")
+
+def backoff(attempt: int) -> float:
+    """Пауза перед повтором номер attempt после ошибки сети"""
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX)
+
+def retry_delay(code: int, payload: bytes, attempt: int, read_only: bool) -> Optional[float]:
+    """Пауза перед повтором по ответу Telegram или None, если повторять не нужно"""
+    if code == HTTPStatus.TOO_MANY_REQUESTS:
+        try:
+            retry_after = json.loads(payload)["parameters"]["retry_after"]
+        except (ValueError, KeyError, TypeError):
+            return backoff(attempt)
+        # Слишком долгое ожидание не должно занимать обработчик
+        return retry_after if retry_after <= MAX_RETRY_AFTER else None
+    # После 5xx сообщение могло уже дойти, поэтому повторяем только чтение
+    if code >= HTTPStatus.INTERNAL_SERVER_ERROR and read_only:
+        return backoff(attempt)
+    return None
@@ -0,0 +1,178 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+from datetime import datetime
+from typing import List
+
+from database import Database
+from tasks import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+# Папка со снимками базы
+BACKUP_DIR = "backups"
+
+# Как часто делать снимок (в секундах)
+BACKUP_INTERVAL = 6 * 3600
+
+# Сколько последних снимков хранить
+BACKUP_KEEP = 7
+
+SNAPSHOT_PATTERN = re.compile(r"^bot-\d{8}-\d{6}\.db\.gz$")
+
+class BackupManager(BackgroundTask):
+    """Горячее резервное копирование bot.db и восстановление из снимка.
+
+    Снимок делается через backup API SQLite за один шаг в отдельном потоке:
+    в режиме WAL копия читается из одного снимка базы, поэтому цикл событий
+    не блокируется, а команды бота пишут в базу как обычно. Пошаговое
+    копирование здесь не подходит - любая запись в базу начинает его
+    заново с первой страницы. Каждый снимок проверяется integrity_check,
+    сжимается gzip и сопровождается файлом с SHA-256.
+    """
+
+    def __init__(self, db: Database, backup_dir: str = BACKUP_DIR):
+        super().__init__()
+        self.db = db
+        self.backup_dir = backup_dir
+        self._lock = asyncio.Lock()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(BACKUP_INTERVAL)
+            try:
+                name = await self.create()
+                logger.info(f"Создан снимок базы: {name}")
+            except Exception as e:
+                logger.error(f"Ошибка при резервном копировании: {e}")
+
+    async def create(self) -> str:
+        """Сделать снимок базы и вернуть имя файла"""
+        async with self._lock:
+            return await asyncio.to_thread(self._create)
+
+    async def restore(self, name: str):
+        """Восстановить базу из снимка"""
+        async with self._lock:
+            await asyncio.to_thread(self._restore, name)
+
+    def list_snapshots(self) -> List[str]:
+        """Снимки от новых к старым"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        return sorted(
+            (name for name in os.listdir(self.backup_dir) if SNAPSHOT_PATTERN.match(name)),
+            reverse=True
+        )
+
+    def _path(self, name: str) -> str:
+        if not SNAPSHOT_PATTERN.match(name):
+            raise ValueError(f"Некорректное имя снимка: {name}")
+        return os.path.join(self.backup_dir, name)
+
+    def _create(self) -> str:
+        os.makedirs(self.backup_dir, exist_ok=True)
+        name = f"bot-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz"
+        path = self._path(name)
+        tmp_path = path[:-len(".gz")] + ".tmp"
+
+        try:
+            # Онлайн-копия за один шаг: читатель WAL не мешает писателям
+            src = sqlite3.connect(self.db.db_path, timeout=30)
+            dst = sqlite3.connect(tmp_path)
+            try:
+                src.backup(dst, pages=-1)
+                check_integrity(dst)
+            finally:
+                dst.close()
+                src.close()
+
+            digest = compress(tmp_path, path)
+            with open(path + ".sha256", "w") as f:
+                f.write(digest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self._rotate()
+        return name
+
+    def _restore(self, name: str):
+        path = self._path(name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Снимок не найден: {name}")
+
+        # Проверяем, что архив не повреждён
+        with open(path + ".sha256") as f:
+            expected = f.read().strip()
+        if file_sha256(path) != expected:
+            raise ValueError(f"Контрольная сумма снимка {name} не совпадает")
+
+        tmp_path = path[:-len(".gz")] + ".restore"
+        try:
+            with gzip.open(path, "rb") as src, open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+            snapshot = sqlite3.connect(tmp_path)
+            live = sqlite3.connect(self.db.db_path, timeout=30)
+            try:
+                check_integrity(snapshot)
+                # Копируем снимок поверх живой базы через тот же backup API:
+                # открытые соединения увидят новое содержимое
+                snapshot.backup(live, pages=-1)
+            finally:
+                live.close()
+                snapshot.close()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _rotate(self):
+        for name in self.list_snapshots()[BACKUP_KEEP:]:
+            path = self._path(name)
+            os.remove(path)
+            if os.path.exists(path + ".sha256"):
+                os.remove(path + ".sha256")
+
+def check_integrity(conn: sqlite3.Connection):
+    """Проверить целостность базы"""
+    result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    if result != "ok":
+        raise ValueError(f"Проверка целостности не пройдена: {result}")
+
+def compress(src_path: str, dst_path: str) -> str:
+    """Сжать файл gzip и вернуть SHA-256 архива"""
+    with open(src_path, "rb") as src, gzip.open(dst_path, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, length=1024 * 1024)
+    return file_sha256(dst_path)
+
+def file_sha256(path: str) -> str:
+    """SHA-256 файла"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+if __name__ == "__main__":
+    # Ручное управление: python backup.py create | list | restore <имя>
+    manager = BackupManager(Database())
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+
+    if command == "create":
+        print(f"✅ Снимок создан: {asyncio.run(manager.create())}")
+    elif command == "list":
+        for snapshot in manager.list_snapshots():
+            print(snapshot)
+    elif command == "restore" and len(sys.argv) == 3:
+        asyncio.run(manager.restore(sys.argv[2]))
+        print(f"✅ База восстановлена из {sys.argv[2]}")
+    else:
+        print("Использование: python backup.py create | list | restore <имя снимка>")
+        sys.exit(1)
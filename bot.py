@@ -0,0 +1,1252 @@
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+import json
+import os
+import aiosqlite
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, InlineQueryHandler
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, TelegramError, TimedOut
+
+from config import BOT_TOKEN, DAILY_COOLDOWN, xp_for_level, ADMIN_IDS, CARD_RARITY
+from database import Database
+from cards import (
+    get_random_card, get_card_info, format_card_message, get_card_xp, plan_upgrades, has_upgrades,
+    CARDS, RARITIES, CARDS_BY_RARITY, CARD_CAPTIONS
+)
+from reminders import ReminderScheduler
+from trading import OrderBook, MAX_OPEN_OFFERS
+from rng import RngService
+from inline import CardMediaCache, INLINE_CACHE_TIME
+from achievements import progress
+from stats import StatsAggregator
+from backup import BackupManager
+from seasons import SeasonManager
+from diagnostics import traced, instrument, measure, LoopLagMonitor, profile_loop, PROFILE_MAX_SECONDS
+from api_client import ApiRequest
+
+# Инициализация базы данных
+db = Database()
+
+# При включённой диагностике время запросов к базе попадает в разбивку обработчиков
+instrument(Database, "db")
+
+# Мониторинг задержки цикла событий (только при включённой диагностике)
+lag_monitor = LoopLagMonitor()
+
+# Фоновая рассылка напоминаний
+reminder_scheduler = ReminderScheduler(db)
+
+# Фоновое обновление статистики
+stats_aggregator = StatsAggregator(db)
+
+# Резервное копирование базы
+backup_manager = BackupManager(db)
+
+# Переход на новый сезон
+season_manager = SeasonManager(db)
+
+# Воспроизводимый генератор случайных чисел для розыгрышей
+rng = RngService(db)
+
+# file_id анимаций карточек и готовые inline-результаты
+card_media = CardMediaCache(db)
+
+# Книга заявок на обмен
+order_book = OrderBook()
+
+# Сколько предложений показывать в /offers
+OFFERS_PAGE_SIZE = 10
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /start"""
+    if not update.effective_user:
+        return
+    
+    await db.create_user(
+        update.effective_user.id,
+        update.effective_user.username or "Anonymous"
+    )
+    
+    welcome_text = """
+🎮 Привет! Я бот для коллекционирования карточек!
+
+Доступные команды:
+/dailycard - Получить ежедневную карточку
+/mycards - Посмотреть свою коллекцию
+/profile - Посмотреть свой профиль
+/cardinfo <название> - Информация о карточке
+/leaderboard - Посмотреть список лучших
+/upgrade - улучшить 3 одинаковых карты
+/upgrade all [редкость] - улучшить всё, что можно
+/remind - включить/выключить напоминание о новой карточке
+/trade <ваша карточка> = <нужная карточка> - предложить обмен
+/offers [карточка или редкость] - открытые предложения обмена
+/myoffers - ваши предложения обмена
+/achievements - достижения за сбор коллекции
+
+Удачи в коллекционировании! 🎉
+"""
+    await update.message.reply_text(welcome_text)
+
+async def calculate_level(xp: int) -> tuple[int, int, int]:
+    """Вычисляет текущий уровень, текущий опыт и опыт до следующего уровня"""
+    level = 1
+    while xp >= xp_for_level(level):
+        xp -= xp_for_level(level)
+        level += 1
+    return level, xp, xp_for_level(level) - xp
+
+async def format_time_until(target_time: Optional[datetime]) -> str:
+    """Форматирует оставшееся время"""
+    if not target_time:
+        return "сейчас"
+    
+    now = datetime.now()
+    if target_time <= now:
+        return "сейчас"
+    
+    diff = target_time - now
+    total_seconds = diff.total_seconds()
+    
+    # Всегда показываем часы и минуты
+    total_minutes = int(total_seconds / 60)
+    hours = total_minutes // 60
+    minutes = total_minutes % 60
+    
+    return f"{hours}ч {minutes}м"
+
+async def send_card_message(message: str, image_path: str, update: Update, card_name: Optional[str] = None):
+    """Отправить сообщение с изображением или анимацией карточки"""
+    # Если анимация уже загружалась, отправляем её по file_id без повторной загрузки
+    await card_media.load()
+    file_id = card_media.get_file_id(card_name)
+    if file_id:
+        try:
+            await update.effective_message.reply_animation(
+                animation=file_id,
+                caption=message,
+                parse_mode=ParseMode.HTML
+            )
+            return
+        except BadRequest as e:
+            # file_id больше не действителен - загружаем анимацию заново
+            logging.warning(f"Не удалось отправить {card_name} по file_id: {e}")
+
+    if not os.path.exists(image_path):
+        await update.effective_message.reply_text(
+            message,
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    try:
+        # Определяем расширение файла
+        file_ext = os.path.splitext(image_path)[1].lower()
+        
+        with measure("file"):
+            with open(image_path, 'rb') as media_file:
+                media = media_file.read()
+        filename = os.path.basename(image_path)
+        
+        if file_ext in ['.mp4', '.gif']:
+            # Для анимированных файлов используем animation
+            sent = await update.effective_message.reply_animation(
+                animation=media,
+                filename=filename,
+                caption=message,
+                parse_mode=ParseMode.HTML
+            )
+            # Запоминаем file_id для следующих отправок и inline-режима
+            if card_name and sent.animation:
+                await card_media.set_file_id(card_name, sent.animation.file_id)
+        else:
+            # Для статичных изображений используем photo
+            await update.effective_message.reply_photo(
+                photo=media,
+                filename=filename,
+                caption=message,
+                parse_mode=ParseMode.HTML
+            )
+    except (OSError, BadRequest, TimedOut) as e:
+        # Файл не читается, Telegram не принял медиа или загрузка не уложилась
+        # в таймаут после повторов - отправляем только текст
+        logging.error(f"Ошибка при отправке медиа карточки: {e}")
+        await update.effective_message.reply_text(
+            message,
+            parse_mode=ParseMode.HTML
+        )
+
+async def notify_achievements(bot, user_id: int):
+    """Сообщить пользователю о новых достижениях"""
+    for achievement in db.pop_new_achievements(user_id):
+        try:
+            await bot.send_message(
+                chat_id=user_id,
+                text=f"🏅 Новое достижение: {achievement.title}!\n"
+                     f"Получено {achievement.xp} опыта"
+            )
+        except Forbidden:
+            await db.mark_blocked([user_id])
+            return
+        except TelegramError as e:
+            logging.error(f"Не удалось сообщить о достижении: {e}")
+
+async def dailycard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /dailycard"""
+    if not update.effective_user or not update.effective_message:
+        return
+
+    user = await db.get_user(update.effective_user.id)
+    if not user:
+        await db.create_user(
+            update.effective_user.id,
+            update.effective_user.username or "Anonymous"
+        )
+        user = await db.get_user(update.effective_user.id)
+
+    now = datetime.now()
+    
+    # Проверяем кулдаун
+    if user and user['last_daily']:
+        try:
+            last_daily = datetime.fromisoformat(user['last_daily'].replace('Z', '+00:00'))
+            next_daily = last_daily + timedelta(seconds=DAILY_COOLDOWN)
+            
+            if now < next_daily:
+                time_until = await format_time_until(next_daily)
+                hint = "" if user['remind'] else "\n🔔 /remind - напомнить, когда карточка будет доступна"
+                await update.effective_message.reply_text(
+                    f"⌛ Следующую карточку можно получить через {time_until}{hint}"
+                )
+                return
+        except ValueError:
+            pass
+
+    # Первое получение карточки: время последнего получения сброс сезона не трогает,
+    # поэтому игрок, у которого сезон обнулил коллекцию, бонус новичка снова не получит
+    is_first_card = not user['last_daily']
+
+    # Все случайные выборы этого получения записываются в журнал розыгрышей
+    draw = await rng.open_draw(update.effective_user.id, "daily")
+    
+    # Получаем случайную карточку
+    card_name, card_info = get_random_card(draw.stream("card"))
+    draw.outcome["card"] = card_name
+    
+    # Специальный эффект для артифактных карточек
+    if card_info['rarity'] == 'artifact':
+        # 50/50 шанс на дополнительную карточку или потерю случайной
+        if draw.stream("artifact").random() < 0.5:
+            # Получаем случайную карточку любой редкости
+            bonus_card_name, bonus_card_info = get_random_card(draw.stream("artifact_bonus"))
+            draw.outcome["artifact"] = "bonus"
+            draw.outcome["bonus"] = bonus_card_name
+            await db.add_card(update.effective_user.id, bonus_card_name)
+            await update.effective_message.reply_text(
+                f"🎁 Артифактная карточка принесла вам бонус!\n"
+                f"Получена дополнительная карточка: {bonus_card_name} ({bonus_card_info['rarity']})"
+            )
+        else:
+            draw.outcome["artifact"] = "loss"
+            # Получаем список карточек пользователя
+            user_cards = await db.get_user_cards(update.effective_user.id)
+            if user_cards:
+                # Выбираем случайную карточку для удаления
+                lost_index = draw.stream("artifact_loss").randbelow(len(user_cards))
+                card_to_remove = user_cards[lost_index]
+                draw.outcome["owned"] = len(user_cards)
+                draw.outcome["lost_index"] = lost_index
+                draw.outcome["lost"] = card_to_remove['card_name']
+                await db.remove_card(update.effective_user.id, card_to_remove['card_name'])
+                await update.effective_message.reply_text(
+                    f"💀 Артифактная карточка забрала у вас карточку: {card_to_remove['card_name']}"
+                )
+    
+    # Добавляем карточку пользователю
+    count = await db.add_card(update.effective_user.id, card_name)
+
+    # Если это первая карточка пользователя, даём бонусную
+    bonus_message = ""
+    if is_first_card:
+        bonus_card_name, bonus_card_info = get_random_card(draw.stream("newbie"))
+        draw.outcome["newbie"] = bonus_card_name
+        await db.add_card(update.effective_user.id, bonus_card_name)
+        bonus_message = f"\n\n🎁 Бонус для новичка!\nВы получаете дополнительную карточку: {bonus_card_name} ({RARITIES[bonus_card_info['rarity']].title})"
+    
+    # Проверяем на тройку одинаковых карточек
+    if count % 3 == 0:
+        bonus_xp = RARITIES[card_info['rarity']].triple_bonus
+        await db.add_xp(update.effective_user.id, bonus_xp)
+        await update.effective_message.reply_text(
+            f"🎉 Бонус! У вас {count} карточек {card_name}!\n"
+            f"Получено дополнительно {bonus_xp} опыта!"
+        )
+    
+    # Обновляем время последнего получения
+    await db.update_last_daily(update.effective_user.id, card_info['rarity'])
+    await draw.save()
+    
+    # Начисляем опыт
+    xp = get_card_xp(card_info["rarity"])
+    await db.add_xp(update.effective_user.id, xp)
+    
+    # Получаем общее количество карточек
+    user_cards = await db.get_user_cards(update.effective_user.id)
+    total_cards = sum(card['count'] for card in user_cards)
+    
+    # Форматируем и отправляем сообщение
+    next_daily = now + timedelta(seconds=DAILY_COOLDOWN)
+    time_until = await format_time_until(next_daily)
+    
+    message = format_card_message(
+        update.effective_user.username or "Anonymous",
+        card_name,
+        card_info,
+        total_cards,
+        time_until
+    ) + bonus_message
+    
+    await send_card_message(message, card_info['image_path'], update, card_name)
+    await notify_achievements(context.bot, update.effective_user.id)
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile"""
+    if not update.effective_user or not update.effective_message:
+        return
+
+    user = await db.get_user(update.effective_user.id)
+    if not user:
+        await update.effective_message.reply_text("❌ Профиль не найден. Используйте /start для начала игры.")
+        return
+
+    xp = user['xp']
+    level, current_xp, xp_needed = await calculate_level(xp)
+    
+    user_cards = await db.get_user_cards(update.effective_user.id)
+    total_cards = sum(card['count'] for card in user_cards)
+    
+    unique_cards = len(user_cards)
+    
+    profile_text = f"""
+👤 Профиль @{update.effective_user.username or "Anonymous"}
+
+📊 Уровень: {level}
+⭐️ Опыт: {current_xp}/{xp_needed}
+🎴 Карточек: {total_cards} (уникальных: {unique_cards})
+"""
+    
+    await update.effective_message.reply_text(profile_text)
+
+async def mycards(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /mycards"""
+    if not update.effective_user or not update.effective_message:
+        return
+
+    user_cards = await db.get_user_cards(update.effective_user.id)
+    if not user_cards:
+        await update.effective_message.reply_text("У вас пока нет карточек. Используйте /dailycard чтобы получить первую!")
+        return
+
+    # Группируем карточки по редкости (от самой редкой к самой частой)
+    cards_by_rarity = {
+        rarity: [] for rarity in sorted(RARITIES, key=lambda r: RARITIES[r].order, reverse=True)
+    }
+    
+    for card in user_cards:
+        card_info = get_card_info(card['card_name'])
+        if card_info:
+            cards_by_rarity[card_info['rarity']].append(
+                f"{card['card_name']} (x{card['count']})"
+            )
+
+    # Форматируем сообщение
+    message = "🎴 Ваша коллекция:\n\n"
+    for rarity, cards in cards_by_rarity.items():
+        if cards:
+            message += f"{RARITIES[rarity].label}:\n"
+            message += "\n".join(f"• {card}" for card in cards)
+            message += "\n\n"
+
+    await update.effective_message.reply_text(message)
+
+async def cardinfo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /cardinfo"""
+    if not update.effective_message or not context.args:
+        await update.effective_message.reply_text(
+            "❌ Укажите название карточки: /cardinfo <название>"
+        )
+        return
+
+    card_name = " ".join(context.args)
+    card_info = get_card_info(card_name)
+    
+    if not card_info:
+        await update.effective_message.reply_text("❌ Карточка не найдена")
+        return
+
+    message = CARD_CAPTIONS[card_name].info
+
+    await send_card_message(message, card_info['image_path'], update, card_name)
+
+async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /leaderboard [сезон]"""
+    if not update.effective_message:
+        return
+    
+    current_season = await db.get_season()
+    season = current_season
+    if context.args:
+        if not context.args[0].isdigit():
+            await update.effective_message.reply_text("❌ Использование: /leaderboard [номер сезона]")
+            return
+        season = int(context.args[0])
+    
+    if season == current_season:
+        leaders = await db.get_leaderboard()
+    elif season < current_season:
+        # Прошедшие сезоны читаются из архива, а не из живых таблиц
+        leaders = await db.get_season_leaderboard(season)
+    else:
+        await update.effective_message.reply_text(
+            f"❌ Сезон {season} ещё не начался (сейчас идёт сезон {current_season})"
+        )
+        return
+    
+    if not leaders:
+        await update.effective_message.reply_text("📊 Пока нет данных для таблицы лидеров")
+        return
+    
+    message = f"🏆 Таблица лидеров (сезон {season}):\n\n"
+    for i, leader in enumerate(leaders, 1):
+        message += f"{i}. {leader['username']}\n"
+        message += f"   ⭐️ {leader['xp']} опыта\n"
+        message += f"   🎴 {leader['total_cards']} карточек ({leader['unique_cards']} уникальных)\n\n"
+    
+    if season == current_season and current_season > 1:
+        message += "📜 Прошлые сезоны: /leaderboard <номер>"
+    
+    await update.effective_message.reply_text(message)
+
+async def upgrade_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Массовое улучшение: /upgrade all [редкость]"""
+    rarity = None
+    if len(context.args) > 1:
+        rarity = context.args[1].lower()
+        if rarity not in RARITIES or not RARITIES[rarity].next_rarity:
+            await update.effective_message.reply_text(
+                "❌ Укажите редкость, которую можно улучшить: "
+                + ", ".join(r for r, info in RARITIES.items() if info.next_rarity)
+            )
+            return
+
+    user_id = update.effective_user.id
+    # Без 3 одинаковых карточек розыгрыш не открываем, чтобы не засорять журнал
+    counts = {row['card_name']: row['count'] for row in await db.get_user_cards(user_id)}
+    if not has_upgrades(counts, rarity):
+        await update.effective_message.reply_text("❌ Нечего улучшать: нужно 3 одинаковые карточки")
+        return
+
+    draw = await rng.open_draw(user_id, "upgrade_all")
+    stream = draw.stream("cards")
+
+    def plan(counts):
+        # Если карточки успели потратить, коллекцию в журнал не пишем: улучшений не будет
+        draw.outcome = {"rarity": rarity, "inventory": counts if has_upgrades(counts, rarity) else {}}
+        return plan_upgrades(counts, stream, rarity)
+
+    # Расчёт и применение всех улучшений - одна транзакция
+    result = await db.apply_card_plan(user_id, plan)
+    draw.outcome.update(upgrades=result.upgrades, gained=result.gained)
+    await draw.save()
+
+    if not result.upgrades:
+        await update.effective_message.reply_text("❌ Нечего улучшать: нужно 3 одинаковые карточки")
+        return
+
+    # Форматируем сообщение
+    message = "✨ Массовое улучшение успешно!\n\n"
+    for current, times in result.upgrades.items():
+        next_rarity = RARITIES[current].next_rarity
+        message += f"{RARITIES[current].label} → {RARITIES[next_rarity].label}: {times}\n"
+
+    # Считаем по самому плану: карточки, полученные и потраченные в каскаде, тоже учитываются
+    spent = sum(result.spent.values())
+    received = sorted(
+        Counter(result.gained).items(),
+        key=lambda item: RARITIES[CARDS[item[0]]['rarity']].order,
+        reverse=True
+    )
+    message += f"\nПотрачено карточек: {spent}\n"
+    message += "Получено:\n"
+    message += "\n".join(
+        f"{RARITIES[CARDS[card_name]['rarity']].emoji} {card_name} (x{count})"
+        for card_name, count in received
+    )
+
+    await update.effective_message.reply_text(message)
+    await notify_achievements(context.bot, user_id)
+
+async def upgrade(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /upgrade"""
+    if not update.effective_message or not context.args:
+        await update.effective_message.reply_text(
+            "❌ Укажите название карточки: /upgrade <название> или /upgrade all [редкость]"
+        )
+        return
+    
+    if context.args[0].lower() == "all" and update.effective_user:
+        await upgrade_all(update, context)
+        return
+    
+    card_name = " ".join(context.args)
+    card_info = get_card_info(card_name)
+    
+    if not card_info:
+        await update.effective_message.reply_text("❌ Карточка не найдена")
+        return
+    
+    if card_info['rarity'] == "artifact":
+        await update.effective_message.reply_text("❌ Артифактные карточки нельзя улучшить")
+        return
+    
+    # Пытаемся улучшить карточки
+    result = await db.upgrade_cards(update.effective_user.id, card_name)
+    if not result:
+        await update.effective_message.reply_text(
+            f"❌ Для улучшения нужно 3 карточки {card_name}"
+        )
+        return
+    
+    # Определяем следующую редкость
+    next_rarity = RARITIES[card_info['rarity']].next_rarity
+    
+    # Ищем случайную карточку следующей редкости
+    available_cards = CARDS_BY_RARITY.get(next_rarity)
+    
+    if not available_cards:
+        await update.effective_message.reply_text("❌ Ошибка: нет карточек для улучшения")
+        return
+    
+    # Выбираем случайную карточку новой редкости
+    draw = await rng.open_draw(update.effective_user.id, "upgrade")
+    new_card_name = draw.stream("card").choice(available_cards)
+    draw.outcome = {"from": card_name, "card": new_card_name}
+    await draw.save()
+    new_card_info = get_card_info(new_card_name)
+    
+    # Добавляем новую карточку
+    await db.add_card(update.effective_user.id, new_card_name)
+    
+    # Форматируем сообщение
+    message = f"""✨ Улучшение успешно!
+
+Потрачено: 3x {card_name} ({card_info['rarity']})
+Получено: {CARD_CAPTIONS[new_card_name].upgrade}"""
+
+    await send_card_message(message, new_card_info['image_path'], update, new_card_name)
+    await notify_achievements(context.bot, update.effective_user.id)
+
+async def remind(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /remind"""
+    if not update.effective_user or not update.effective_message:
+        return
+
+    user = await db.get_user(update.effective_user.id)
+    if not user:
+        await update.effective_message.reply_text("❌ Профиль не найден. Используйте /start для начала игры.")
+        return
+
+    if user['remind']:
+        await db.set_reminders(update.effective_user.id, False)
+        await update.effective_message.reply_text("🔕 Напоминания выключены")
+        return
+
+    # Если кулдаун ещё идёт, сразу ставим напоминание на его окончание
+    due_at = None
+    if user['last_daily']:
+        try:
+            last_daily = datetime.fromisoformat(user['last_daily'].replace('Z', '+00:00'))
+            next_daily = last_daily + timedelta(seconds=DAILY_COOLDOWN)
+            if next_daily > datetime.now():
+                due_at = int(next_daily.timestamp())
+        except ValueError:
+            pass
+
+    await db.set_reminders(update.effective_user.id, True, due_at)
+    await update.effective_message.reply_text(
+        "🔔 Напоминания включены! Я напишу, когда можно будет получить новую карточку"
+    )
+
+def format_offer(offer) -> str:
+    """Строка с описанием предложения обмена"""
+    give_emoji = RARITIES[CARDS[offer.give_card]['rarity']].emoji
+    want_emoji = RARITIES[CARDS[offer.want_card]['rarity']].emoji
+    return f"#{offer.offer_id}: {give_emoji} {offer.give_card} → {want_emoji} {offer.want_card}"
+
+async def trade(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /trade"""
+    if not update.effective_user or not update.effective_message:
+        return
+
+    text = " ".join(context.args or [])
+    if "=" not in text:
+        await update.effective_message.reply_text(
+            "❌ Использование: /trade <ваша карточка> = <нужная карточка>"
+        )
+        return
+
+    give_card, want_card = (part.strip() for part in text.split("=", 1))
+    if not get_card_info(give_card) or not get_card_info(want_card):
+        await update.effective_message.reply_text("❌ Карточка не найдена")
+        return
+
+    if give_card == want_card:
+        await update.effective_message.reply_text("❌ Нельзя обменять карточку на такую же")
+        return
+
+    user_id = update.effective_user.id
+    await order_book.sync(db)
+    if len(order_book.seller_offers(user_id)) >= MAX_OPEN_OFFERS:
+        await update.effective_message.reply_text(
+            f"❌ У вас уже {MAX_OPEN_OFFERS} открытых предложений. Отмените лишние в /myoffers"
+        )
+        return
+
+    offer_id = await db.create_trade_offer(user_id, give_card, want_card)
+    if not offer_id:
+        await update.effective_message.reply_text(f"❌ У вас нет карточки {give_card}")
+        return
+    await order_book.sync(db)
+
+    message = f"🤝 Предложение #{offer_id} создано!\nОтдаёте: {give_card}\nХотите: {want_card}"
+    buttons = [[InlineKeyboardButton("❌ Отменить", callback_data=f"trade:cancel:{offer_id}")]]
+
+    # Если кто-то уже предлагает обратный обмен, сразу показываем его
+    match = order_book.find_match(give_card, want_card, user_id)
+    if match:
+        message += f"\n\n⚡ Есть встречное предложение #{match.offer_id}!"
+        buttons.insert(0, [
+            # Вместе с обменом закрывается и только что созданное предложение
+            InlineKeyboardButton(
+                f"✅ Принять #{match.offer_id}",
+                callback_data=f"trade:accept:{match.offer_id}:{offer_id}"
+            )
+        ])
+
+    await update.effective_message.reply_text(message, reply_markup=InlineKeyboardMarkup(buttons))
+
+async def offers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /offers"""
+    if not update.effective_user or not update.effective_message:
+        return
+
+    query = " ".join(context.args or [])
+    card_name = rarity = None
+    if query:
+        if query.lower() in RARITIES:
+            rarity = query.lower()
+        elif get_card_info(query):
+            card_name = query
+        else:
+            await update.effective_message.reply_text("❌ Карточка или редкость не найдена")
+            return
+
+    await order_book.sync(db)
+    found = order_book.find(card_name, rarity, limit=OFFERS_PAGE_SIZE)
+    if not found:
+        await update.effective_message.reply_text("📭 Открытых предложений нет")
+        return
+
+    total = order_book.count(card_name, rarity)
+    message = f"🤝 Предложения обмена (показано {len(found)} из {total}):\n\n"
+    message += "\n".join(format_offer(offer) for offer in found)
+    buttons = [
+        [InlineKeyboardButton(f"✅ Принять #{offer.offer_id}", callback_data=f"trade:accept:{offer.offer_id}")]
+        for offer in found
+        if offer.seller_id != update.effective_user.id
+    ]
+
+    await update.effective_message.reply_text(
+        message,
+        reply_markup=InlineKeyboardMarkup(buttons) if buttons else None
+    )
+
+async def myoffers(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /myoffers"""
+    if not update.effective_user or not update.effective_message:
+        return
+
+    await order_book.sync(db)
+    message, markup = render_own_offers(update.effective_user.id)
+    await update.effective_message.reply_text(message, reply_markup=markup)
+
+def render_own_offers(user_id: int):
+    """Текст и кнопки отмены для списка открытых предложений пользователя"""
+    own = order_book.seller_offers(user_id)
+    if not own:
+        return "📭 У вас нет открытых предложений", None
+
+    message = "🤝 Ваши предложения:\n\n" + "\n".join(format_offer(offer) for offer in own)
+    buttons = [
+        [InlineKeyboardButton(f"❌ Отменить #{offer.offer_id}", callback_data=f"trade:mycancel:{offer.offer_id}")]
+        for offer in own
+    ]
+    return message, InlineKeyboardMarkup(buttons)
+
+async def trade_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопок принятия и отмены обмена"""
+    query = update.callback_query
+    if not query or not query.data:
+        return
+
+    try:
+        _, action, offer_id, *own_offer = query.data.split(":")
+        offer_id = int(offer_id)
+        # Своё встречное предложение, которое отменяется вместе с обменом
+        own_offer_id = int(own_offer[0]) if own_offer else None
+    except (ValueError, IndexError):
+        await query.answer()
+        return
+
+    user_id = query.from_user.id
+
+    if action in ("cancel", "mycancel"):
+        cancelled = await db.cancel_trade_offer(offer_id, user_id)
+        await order_book.sync(db)
+        if not cancelled:
+            await query.answer("❌ Предложение уже неактуально", show_alert=True)
+            return
+
+        await query.answer("🚫 Предложение отменено")
+        if action == "mycancel":
+            # В списке /myoffers перерисовываем оставшиеся предложения с их кнопками
+            message, markup = render_own_offers(user_id)
+            await query.edit_message_text(message, reply_markup=markup)
+        else:
+            await query.edit_message_text(f"🚫 Предложение #{offer_id} отменено")
+        return
+
+    if action != "accept":
+        await query.answer()
+        return
+
+    await order_book.sync(db)
+    offer = order_book.get(offer_id)
+    if offer and offer.seller_id == user_id:
+        await query.answer("❌ Нельзя принять своё предложение", show_alert=True)
+        return
+
+    result = await db.execute_trade(offer_id, user_id, cancel_offer_id=own_offer_id)
+    await order_book.sync(db)
+    if not result:
+        await query.answer(
+            "❌ Обмен не удался: предложение неактуально или у кого-то нет нужной карточки",
+            show_alert=True
+        )
+        return
+
+    await query.answer("✅ Обмен совершён!")
+    await query.message.reply_text(
+        f"✅ Обмен #{offer_id} совершён!\n"
+        f"@{query.from_user.username or 'Anonymous'} получил {result['give_card']} "
+        f"и отдал {result['want_card']}"
+    )
+
+    # Сообщаем автору предложения
+    try:
+        await context.bot.send_message(
+            chat_id=result['seller_id'],
+            text=f"🤝 Ваше предложение #{offer_id} принято!\n"
+                 f"Вы получили {result['want_card']} и отдали {result['give_card']}"
+        )
+    except Forbidden:
+        await db.mark_blocked([result['seller_id']])
+    except TelegramError as e:
+        logging.error(f"Не удалось уведомить об обмене: {e}")
+
+    await notify_achievements(context.bot, user_id)
+    await notify_achievements(context.bot, result['seller_id'])
+
+async def achievements(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /achievements"""
+    if not update.effective_user or not update.effective_message:
+        return
+
+    bits = await db.get_collection_bits(update.effective_user.id)
+    unlocked = set(await db.get_achievements(update.effective_user.id))
+
+    message = "🏅 Достижения:\n\n"
+    for achievement, owned in progress(bits):
+        mark = "✅" if achievement.key in unlocked else "▫️"
+        message += f"{mark} {achievement.title}: {owned}/{achievement.size} (+{achievement.xp} опыта)\n"
+
+    await update.effective_message.reply_text(message)
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск карточек в inline-режиме (@бот название)"""
+    query = update.inline_query
+    if not query:
+        return
+
+    await card_media.load()
+    results, next_offset = card_media.search(query.query, query.offset)
+    await query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=next_offset
+    )
+
+async def is_admin(user_id: int) -> bool:
+    """Проверка на админа"""
+    return user_id in ADMIN_IDS
+
+async def announce(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправить объявление всем пользователям (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    if not context.args:
+        await update.message.reply_text("❌ Укажите текст объявления: /announce <текст>")
+        return
+
+    announcement = " ".join(context.args)
+    
+    # Пользователей, которые заблокировали бота, пропускаем
+    users = await db.get_reachable_users()
+
+    success_count = 0
+    fail_count = 0
+    blocked = []
+
+    # Отправляем сообщение каждому пользователю (при 429 запрос ждёт и повторяется сам)
+    for user_id, _ in users:
+        try:
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=f"📢 ОБЪЯВЛЕНИЕ\n\n{announcement}"
+            )
+            success_count += 1
+        except Forbidden:
+            blocked.append(user_id)
+        except TelegramError as e:
+            logging.error(f"Не удалось отправить объявление {user_id}: {e}")
+            fail_count += 1
+
+    await db.mark_blocked(blocked)
+
+    await update.message.reply_text(
+        f"✅ Объявление отправлено!\n"
+        f"Успешно: {success_count}\n"
+        f"Заблокировали бота: {len(blocked)}\n"
+        f"Не удалось: {fail_count}"
+    )
+
+async def replay(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пересчитать розыгрыш по номеру из журнала (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text("❌ Использование: /replay <номер розыгрыша>")
+        return
+
+    try:
+        report = await rng.replay_draw(int(context.args[0]))
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    if not report:
+        await update.message.reply_text("❌ Розыгрыш не найден")
+        return
+
+    draw = report['draw']
+    await update.message.reply_text(
+        f"🎲 Розыгрыш #{draw['draw_id']} ({draw['kind']})\n"
+        f"Пользователь: {draw['user_id']}\n"
+        f"Время: {draw['created_at']}\n\n"
+        f"Сохранено: {json.dumps(report['stored'], ensure_ascii=False)}\n"
+        f"Пересчитано: {json.dumps(report['replayed'], ensure_ascii=False)}\n\n"
+        f"{'✅ Совпадает' if report['match'] else '❌ Не совпадает'}"
+    )
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Статистика активности (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    data = await db.get_stats()
+
+    message = "📊 Статистика\n\n👥 DAU:\n"
+    for row in data['dau']:
+        message += f"• {row['day']}: {row['dau']}\n"
+
+    message += "\n🕐 Получения карточек по часам:\n"
+    for row in data['claims_by_hour']:
+        message += f"• {row['hour'][-2:]}:00 - {row['claims']}\n"
+
+    # Фактическое распределение выпадений против весов из конфигурации
+    total = sum(row['claims'] for row in data['claims_by_rarity'])
+    claims = {row['rarity']: row['claims'] for row in data['claims_by_rarity']}
+    total_weight = sum(settings['weight'] for settings in CARD_RARITY.values())
+    message += f"\n🎲 Выпадения за 7 дней (всего {total}):\n"
+    for rarity, info in RARITIES.items():
+        actual = claims.get(rarity, 0) / total * 100 if total else 0
+        expected = CARD_RARITY[rarity]['weight'] / total_weight * 100
+        message += f"{info.label}: {claims.get(rarity, 0)} ({actual:.2f}% / ожидается {expected:.2f}%)\n"
+
+    message += "\n🎴 Самые популярные карточки:\n"
+    for i, row in enumerate(data['top_cards'], 1):
+        message += f"{i}. {row['card_name']} - {row['total']} шт. у {row['holders']} игроков\n"
+
+    await update.message.reply_text(message)
+
+async def backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сделать снимок базы (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    await update.message.reply_text("⏳ Создаю снимок базы...")
+    try:
+        name = await backup_manager.create()
+    except Exception as e:
+        logging.error(f"Ошибка при резервном копировании: {e}")
+        await update.message.reply_text(f"❌ Не удалось создать снимок: {e}")
+        return
+
+    await update.message.reply_text(f"✅ Снимок создан: {name}")
+
+async def backups(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Список снимков базы (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    snapshots = backup_manager.list_snapshots()
+    if not snapshots:
+        await update.message.reply_text("📭 Снимков пока нет")
+        return
+
+    await update.message.reply_text("💾 Снимки базы:\n\n" + "\n".join(snapshots))
+
+async def restore(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Восстановить базу из снимка (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    if len(context.args) != 1:
+        await update.message.reply_text("❌ Использование: /restore <имя снимка> (список - /backups)")
+        return
+
+    try:
+        await backup_manager.restore(context.args[0])
+    except Exception as e:
+        logging.error(f"Ошибка при восстановлении базы: {e}")
+        await update.message.reply_text(f"❌ Не удалось восстановить базу: {e}")
+        return
+
+    await update.message.reply_text(
+        f"✅ База восстановлена из {context.args[0]}\n"
+        f"Перезапустите бота, чтобы сбросить кэши в памяти"
+    )
+
+async def diagprofile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Профилировать работающего бота и прислать файл для flamegraph (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    try:
+        seconds = float(context.args[0]) if context.args else 10
+        if seconds <= 0:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("❌ Использование: /diagprofile [секунды]")
+        return
+
+    # Дольше PROFILE_MAX_SECONDS профилировщик всё равно не работает
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    await update.message.reply_text(f"⏳ Профилирую {seconds:g} с...")
+    folded = await profile_loop(seconds)
+
+    caption = "🔥 Свёрнутые стеки для flamegraph.pl / speedscope"
+    # Задержку цикла событий меряет только запущенный монитор (при включённой диагностике)
+    if lag_monitor.running:
+        caption += f"\nМакс. задержка цикла событий: {lag_monitor.max_lag_ms:.0f}мс"
+
+    await update.message.reply_document(
+        document=folded.encode(),
+        filename=f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded",
+        caption=caption
+    )
+
+async def endseason(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Завершить текущий сезон (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    season = await db.begin_season_rollover(update.effective_user.id)
+    if season is None:
+        await update.message.reply_text("⏳ Сезон уже завершается, дождитесь окончания")
+        return
+
+    # Переход выполняет фоновая задача; в этом процессе её можно разбудить сразу
+    season_manager.wake()
+    await update.message.reply_text(
+        f"⏳ Сезон {season} завершается: опыт и коллекции переносятся в архив порциями, "
+        f"бот продолжает работать. Когда всё будет готово, придёт сообщение."
+    )
+
+async def backfill(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пересчитать коллекции и достижения по всей базе (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    await update.message.reply_text("⏳ Пересчитываю коллекции...")
+    users = await db.backfill_collections()
+    await update.message.reply_text(f"✅ Коллекции пересчитаны для {users} пользователей")
+
+async def set_xp(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Установить опыт пользователю (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    if len(context.args) != 2:
+        await update.message.reply_text("❌ Использование: /setxp <username> <количество>")
+        return
+
+    username, xp = context.args[0], context.args[1]
+    
+    try:
+        xp = int(xp)
+    except ValueError:
+        await update.message.reply_text("❌ Количество опыта должно быть числом")
+        return
+
+    # Обновляем опыт пользователя
+    async with aiosqlite.connect(db.db_path) as db_conn:
+        await db_conn.execute(
+            "UPDATE users SET xp = ? WHERE username = ?",
+            (xp, username)
+        )
+        await db_conn.commit()
+
+    await update.message.reply_text(f"✅ Установлен опыт {xp} для пользователя {username}")
+
+async def give_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выдать карточку пользователю (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    if len(context.args) < 2:
+        await update.message.reply_text("❌ Использование: /givecard <username> <название_карточки>")
+        return
+
+    username = context.args[0]
+    card_name = " ".join(context.args[1:])
+    
+    # Проверяем существование карточки
+    card_info = get_card_info(card_name)
+    if not card_info:
+        await update.message.reply_text("❌ Карточка не найдена")
+        return
+
+    # Находим ID пользователя по имени
+    async with aiosqlite.connect(db.db_path) as db_conn:
+        cursor = await db_conn.execute(
+            "SELECT user_id FROM users WHERE username = ?",
+            (username,)
+        )
+        user = await cursor.fetchone()
+        
+        if not user:
+            await update.message.reply_text("❌ Пользователь не найден")
+            return
+        
+        user_id = user[0]
+
+    # Выдаем карточку
+    count = await db.add_card(user_id, card_name)
+    await notify_achievements(context.bot, user_id)
+    
+    await update.message.reply_text(
+        f"✅ Выдана карточка {card_name} пользователю {username}\n"
+        f"Теперь у него {count} таких карточек"
+    )
+
+async def mass_gift(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Раздать карточку случайным игрокам (только для админов)"""
+    if not update.effective_user or not await is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+
+    if len(context.args) < 2:
+        await update.message.reply_text("❌ Использование: /massgift <количество_игроков> <название_карточки>")
+        return
+
+    try:
+        num_players = int(context.args[0])
+        if num_players <= 0:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("❌ Количество игроков должно быть положительным числом")
+        return
+
+    card_name = " ".join(context.args[1:])
+    
+    # Проверяем существование карточки
+    card_info = get_card_info(card_name)
+    if not card_info:
+        await update.message.reply_text("❌ Карточка не найдена")
+        return
+
+    # Получаем пользователей, которые не заблокировали бота
+    # (порядок по ID важен: по нему розыгрыш можно воспроизвести)
+    all_users = await db.get_reachable_users()
+
+    if not all_users:
+        await update.message.reply_text("❌ В базе нет пользователей")
+        return
+
+    # Выбираем случайных пользователей
+    draw = await rng.open_draw(update.effective_user.id, "massgift")
+    winner_indices = draw.stream("winners").sample(
+        range(len(all_users)), min(num_players, len(all_users))
+    )
+    selected_users = [all_users[i] for i in winner_indices]
+    draw.outcome = {"card": card_name, "population": len(all_users), "winner_indices": winner_indices}
+    await draw.save()
+    
+    success_count = 0
+    failed_count = 0
+    winners_list = []
+    blocked = []
+
+    # Фиксированный бонус опыта за участие в раздаче
+    GIVEAWAY_XP_BONUS = 50
+
+    # Раздаем карточки
+    for user_id, username in selected_users:
+        try:
+            # Выдаем карточку
+            count = await db.add_card(user_id, card_name)
+            
+            # Добавляем бонусный опыт
+            await db.add_xp(user_id, GIVEAWAY_XP_BONUS)
+
+            message = f"🎉 Поздравляем! Вы выиграли карточку в раздаче!\n\n"
+            message += f"Карточка: {card_name}\n"
+            message += f"Редкость: {RARITIES[card_info['rarity']].title}\n"
+            message += f"У вас теперь {count} таких карточек\n"
+            message += f"Получено {GIVEAWAY_XP_BONUS} опыта за участие в раздаче!"
+
+            # Отправляем уведомление пользователю
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=message
+            )
+            await notify_achievements(context.bot, user_id)
+            
+            success_count += 1
+            winners_list.append(username)
+        except Forbidden:
+            # Карточка выдана, но пользователь заблокировал бота
+            blocked.append(user_id)
+            failed_count += 1
+        except TelegramError as e:
+            logging.error(f"Ошибка при раздаче карточки: {e}")
+            failed_count += 1
+
+    await db.mark_blocked(blocked)
+
+    # Формируем сообщение о результатах
+    result_message = f"✅ Раздача карточки {card_name} завершена!\n\n"
+    result_message += f"Успешно выдано: {success_count}\n"
+    result_message += f"Не удалось выдать: {failed_count}\n"
+    result_message += f"Бонус опыта каждому: {GIVEAWAY_XP_BONUS}\n\n"
+    
+    result_message += "Список победителей:\n"
+    for i, winner in enumerate(winners_list, 1):
+        result_message += f"{i}. {winner}\n"
+
+    await update.message.reply_text(result_message)
+
+async def post_init(app: Application):
+    """Запустить фоновые задачи"""
+    lag_monitor.start()
+    # Остальные фоновые задачи должны работать только в одном процессе
+    if app.bot_data.get("background"):
+        reminder_scheduler.start(app.bot)
+        stats_aggregator.start()
+        backup_manager.start()
+        season_manager.start(app.bot)
+
+async def post_shutdown(app: Application):
+    """Остановить фоновые задачи"""
+    await lag_monitor.stop()
+    await reminder_scheduler.stop()
+    await stats_aggregator.stop()
+    await backup_manager.stop()
+    await season_manager.stop()
+
+def build_application(polling: bool = True, background: bool = True) -> Application:
+    """Создать приложение и зарегистрировать обработчики"""
+    builder = Application.builder().token(BOT_TOKEN)
+    if not polling:
+        # Обновления приходят от диспетчера, собственный updater не нужен
+        builder = builder.updater(None)
+    # Отдельные пулы для загрузок и текста, повтор запросов при 429 и ошибках сети
+    builder = builder.request(ApiRequest())
+    builder = builder.post_init(post_init).post_shutdown(post_shutdown)
+    app = builder.build()
+    app.bot_data["background"] = background
+    
+    # Добавляем обработчики
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("dailycard", dailycard))
+    app.add_handler(CommandHandler("profile", profile))
+    app.add_handler(CommandHandler("mycards", mycards))
+    app.add_handler(CommandHandler("cardinfo", cardinfo))
+    app.add_handler(CommandHandler("leaderboard", leaderboard))
+    app.add_handler(CommandHandler("upgrade", upgrade))
+    app.add_handler(CommandHandler("remind", remind))
+    app.add_handler(CommandHandler("trade", trade))
+    app.add_handler(CommandHandler("offers", offers))
+    app.add_handler(CommandHandler("myoffers", myoffers))
+    app.add_handler(CallbackQueryHandler(trade_callback, pattern=r"^trade:"))
+    app.add_handler(CommandHandler("achievements", achievements))
+    app.add_handler(InlineQueryHandler(inline_query))
+    
+    # Админские команды
+    app.add_handler(CommandHandler("announce", announce))
+    app.add_handler(CommandHandler("setxp", set_xp))
+    app.add_handler(CommandHandler("givecard", give_card))
+    app.add_handler(CommandHandler("massgift", mass_gift))
+    app.add_handler(CommandHandler("replay", replay))
+    app.add_handler(CommandHandler("backfill", backfill))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("backup", backup))
+    app.add_handler(CommandHandler("backups", backups))
+    app.add_handler(CommandHandler("restore", restore))
+    app.add_handler(CommandHandler("endseason", endseason))
+    app.add_handler(CommandHandler("diagprofile", diagprofile))
+    
+    # При включённой диагностике медленные обработчики попадают в лог
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = traced(handler.callback)
+    
+    return app
@@ -1,9 +1,10 @@
 import random
+import hashlib
 import json
 import os
 import logging
-from typing import Dict, Optional, Tuple
-from config import CARD_RARITY
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from config import CARD_RARITY, RARITY_EMOJI, TRIPLE_CARD_BONUS, UPGRADE_RULES
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -58,66 +59,185 @@ def load_cards() -> Dict:
     
     return cards
 
+class RarityInfo(NamedTuple):
+    """Метаданные редкости"""
+    emoji: str
+    title: str           # Название для сообщений ("Common")
+    label: str           # Эмодзи и название ("⚪ Common")
+    xp: int
+    triple_bonus: int
+    next_rarity: Optional[str]
+    order: int           # Порядок от самой частой к самой редкой
+
+class CardCaptions(NamedTuple):
+    """Заранее подготовленные подписи карточки"""
+    drop: str            # Для /dailycard
+    info: str            # Для /cardinfo
+    upgrade: str         # Для /upgrade
+
+def build_rarities() -> Dict[str, RarityInfo]:
+    """Собрать таблицу редкостей из конфигурации"""
+    rarities = {}
+    for order, (rarity, settings) in enumerate(CARD_RARITY.items()):
+        title = rarity.capitalize()
+        rarities[rarity] = RarityInfo(
+            emoji=RARITY_EMOJI[rarity],
+            title=title,
+            label=f"{RARITY_EMOJI[rarity]} {title}",
+            xp=settings["xp"],
+            triple_bonus=TRIPLE_CARD_BONUS[rarity],
+            next_rarity=UPGRADE_RULES.get(rarity),
+            order=order
+        )
+    return rarities
+
+def build_captions(card_name: str, card_info: Dict) -> CardCaptions:
+    """Подготовить подписи карточки без пользовательских полей"""
+    rarity = RARITIES[card_info['rarity']]
+    title = f"{rarity.emoji} [{card_name}]\n🔹 Редкость: {rarity.title}"
+    return CardCaptions(
+        drop=f"{title}\n📝 {card_info['description']}\n🧠 +{rarity.xp} опыта",
+        info=f"\n{title}\n📝 Описание: {card_info['description']}\n🧠 Опыт: +{rarity.xp} XP\n",
+        upgrade=f"{title}\n📝 {card_info['description']}"
+    )
+
+# Таблица редкостей
+RARITIES = build_rarities()
+
 # Загружаем карточки при импорте модуля
 CARDS = load_cards()
 
+def prepare_catalog(cards: Dict) -> Tuple[Dict[str, List[str]], Dict[str, CardCaptions]]:
+    """Один раз подготовить всё, что не зависит от пользователя"""
+    cards_by_rarity = {rarity: [] for rarity in RARITIES}
+    captions = {}
+    for card_name, card_info in cards.items():
+        card_info['image_path'] = get_card_image_path(card_info['image'])
+        cards_by_rarity[card_info['rarity']].append(card_name)
+        captions[card_name] = build_captions(card_name, card_info)
+    return cards_by_rarity, captions
+
+CARDS_BY_RARITY, CARD_CAPTIONS = prepare_catalog(CARDS)
+
+# Позиции карточек в битовом наборе коллекции - порядок каталога
+CARD_BITS: Dict[str, int] = {card_name: i for i, card_name in enumerate(CARDS)}
+
+# Отпечаток каталога: если он изменился, битовые наборы нужно пересчитать
+CATALOG_FINGERPRINT = hashlib.sha1("\n".join(CARDS).encode()).hexdigest()
+
+def build_name_index(cards: Dict) -> Dict[str, Tuple[str, ...]]:
+    """Индекс для поиска: префикс названия (или любого его слова) -> карточки"""
+    index: Dict[str, List[str]] = {"": list(cards)}
+    for card_name in cards:
+        name = card_name.lower()
+        # Ищем и по началу названия, и по началу каждого слова
+        starts = [0] + [i + 1 for i, char in enumerate(name) if char == " "]
+        for start in starts:
+            for end in range(start + 1, len(name) + 1):
+                names = index.setdefault(name[start:end], [])
+                if not names or names[-1] != card_name:
+                    names.append(card_name)
+    return {prefix: tuple(names) for prefix, names in index.items()}
+
+CARD_NAME_INDEX = build_name_index(CARDS)
+
+def search_cards(query: str) -> Tuple[str, ...]:
+    """Найти карточки по началу названия или слова в нём"""
+    return CARD_NAME_INDEX.get(" ".join(query.lower().split()), ())
+
+_RARITY_NAMES = list(CARD_RARITY.keys())
+_RARITY_WEIGHTS = [CARD_RARITY[rarity]["weight"] for rarity in _RARITY_NAMES]
+_ALL_CARD_NAMES = list(CARDS.keys())
+
 def get_card_info(card_name: str) -> Optional[Dict]:
     """Получить информацию о карточке по её названию"""
-    card_info = CARDS.get(card_name)
-    if card_info:
-        # Добавляем полный путь к изображению
-        card_info['image_path'] = get_card_image_path(card_info['image'])
-    return card_info
-
-def get_random_card() -> Tuple[str, Dict]:
-    """Получить случайную карточку с учетом весов редкости"""
-    # Группируем карточки по редкости для более эффективного выбора
-    cards_by_rarity = {}
-    for name, card in CARDS.items():
-        rarity = card["rarity"]
-        if rarity not in cards_by_rarity:
-            cards_by_rarity[rarity] = []
-        cards_by_rarity[rarity].append(name)
-    
+    return CARDS.get(card_name)
+
+def get_random_card(rng=random) -> Tuple[str, Dict]:
+    """Получить случайную карточку с учетом весов редкости.
+
+    rng - источник случайности с интерфейсом модуля random (например, DrawStream).
+    """
     # Выбираем редкость с учетом весов
-    rarities = list(CARD_RARITY.keys())
-    weights = [CARD_RARITY[rarity]["weight"] for rarity in rarities]
-    chosen_rarity = random.choices(rarities, weights=weights, k=1)[0]
+    chosen_rarity = rng.choices(_RARITY_NAMES, weights=_RARITY_WEIGHTS, k=1)[0]
     
     # Выбираем случайную карточку из выбранной редкости
-    available_cards = cards_by_rarity.get(chosen_rarity, [])
+    available_cards = CARDS_BY_RARITY.get(chosen_rarity)
     if not available_cards:
         # Если почему-то нет карточек выбранной редкости, выбираем из всех
-        name = random.choice(list(CARDS.keys()))
+        name = rng.choice(_ALL_CARD_NAMES)
     else:
-        name = random.choice(available_cards)
+        name = rng.choice(available_cards)
     
     # Логируем информацию о выпавшей карточке
     logger.info(f"Выпала карточка: {name} (редкость: {chosen_rarity})")
     
-    card_info = CARDS[name].copy()
-    card_info['image_path'] = get_card_image_path(card_info['image'])
-    return name, card_info
+    return name, CARDS[name]
+
+class UpgradePlan(NamedTuple):
+    """Результат расчёта массового улучшения"""
+    upgrades: Dict[str, int]   # Редкость -> количество улучшений 3→1
+    deltas: Dict[str, int]     # Карточка -> итоговое изменение количества
+    spent: Dict[str, int]      # Редкость -> потрачено карточек (включая полученные в каскаде)
+    gained: List[str]          # Полученные карточки в порядке выпадения
+
+def upgradable_rarities(rarity: Optional[str] = None) -> List[str]:
+    """Редкости, которые участвуют в улучшении, от младшей к старшей"""
+    rarities = [rarity] if rarity else sorted(RARITIES, key=lambda r: RARITIES[r].order)
+    return [
+        current for current in rarities
+        if RARITIES[current].next_rarity and CARDS_BY_RARITY.get(RARITIES[current].next_rarity)
+    ]
+
+def has_upgrades(counts: Dict[str, int], rarity: Optional[str] = None) -> bool:
+    """Есть ли что улучшать: каскад начинается только с уже имеющихся 3 одинаковых карточек"""
+    return any(
+        counts.get(card_name, 0) >= 3
+        for current in upgradable_rarities(rarity)
+        for card_name in CARDS_BY_RARITY[current]
+    )
+
+def plan_upgrades(counts: Dict[str, int], rng=random, rarity: Optional[str] = None) -> UpgradePlan:
+    """Рассчитать все возможные улучшения 3→1 в памяти.
+
+    Без rarity улучшения идут каскадом: полученные карточки сразу участвуют
+    в улучшении следующей редкости. С rarity улучшается только она.
+    """
+    counts = dict(counts)
+    before = dict(counts)
+    upgrades: Dict[str, int] = {}
+    spent: Dict[str, int] = {}
+    gained: List[str] = []
+
+    for current in upgradable_rarities(rarity):
+        next_rarity = RARITIES[current].next_rarity
+        for card_name in CARDS_BY_RARITY[current]:
+            times = counts.get(card_name, 0) // 3
+            if not times:
+                continue
+            counts[card_name] -= 3 * times
+            upgrades[current] = upgrades.get(current, 0) + times
+            spent[current] = spent.get(current, 0) + 3 * times
+            # Все новые карточки для этой карточки - одним пакетом
+            for new_card in rng.choices(CARDS_BY_RARITY[next_rarity], k=times):
+                counts[new_card] = counts.get(new_card, 0) + 1
+                gained.append(new_card)
+
+    deltas = {
+        card_name: counts.get(card_name, 0) - before.get(card_name, 0)
+        for card_name in set(counts) | set(before)
+        if counts.get(card_name, 0) != before.get(card_name, 0)
+    }
+    return UpgradePlan(upgrades, deltas, spent, gained)
 
 def get_card_xp(rarity: str) -> int:
     """Получить количество опыта за карточку определенной редкости"""
-    return CARD_RARITY[rarity]["xp"]
+    return RARITIES[rarity].xp
 
 def format_card_message(username: str, card_name: str, card_info: Dict, total_cards: int, cooldown: str) -> str:
     """Форматировать сообщение о полученной карточке"""
-    rarity_emoji = {
-        "common": "⚪",
-        "rare": "🔵",
-        "epic": "🟣",
-        "legendary": "🟡",
-        "artifact": "🔴"
-    }
-    
     return f"""🎉 @{username} получил карточку:
-{rarity_emoji[card_info['rarity']]} [{card_name}]
-🔹 Редкость: {card_info['rarity'].capitalize()}
-📝 {card_info['description']}
-🧠 +{get_card_xp(card_info['rarity'])} опыта
+{CARD_CAPTIONS[card_name].drop}
 
 👑 Всего карточек у тебя: {total_cards}
-🔁 Следующая попытка: через {cooldown}""" 
\ No newline at end of file
+🔁 Следующая попытка: через {cooldown}"""
@@ -7,6 +7,18 @@ load_dotenv()
 # Конфигурация бота
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Количество процессов-обработчиков (1 - обычный режим без шардирования)
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+
+# Общий сид генератора случайных чисел (если не задан - создаётся и хранится в базе)
+RNG_SEED = os.getenv("RNG_SEED")
+
+# Диагностика: лог медленных обработчиков и задержки цикла событий (DIAGNOSTICS=1)
+DIAGNOSTICS_ENABLED = os.getenv("DIAGNOSTICS") == "1"
+
+# Обработчики дольше этого времени попадают в лог (в миллисекундах)
+SLOW_HANDLER_MS = int(os.getenv("SLOW_HANDLER_MS", "500"))
+
 # Список админов (ID пользователей)
 ADMIN_IDS = [1257601441]
 
@@ -19,6 +31,15 @@ CARD_RARITY = {
     "artifact": {"weight": 0.01, "xp": 200}
 }
 
+# Эмодзи редкостей
+RARITY_EMOJI = {
+    "common": "⚪",
+    "rare": "🔵",
+    "epic": "🟣",
+    "legendary": "🟡",
+    "artifact": "🔴"
+}
+
 # Время ожидания между сбором карточек (в секундах)
 DAILY_COOLDOWN = 7200  # 2 часа
 
@@ -35,10 +56,33 @@ TRIPLE_CARD_BONUS = {
     "artifact": 1200
 }
 
+# Награда (опыт) за сбор всех карточек редкости и всего каталога
+ACHIEVEMENT_XP = {
+    "common": 200,
+    "rare": 500,
+    "epic": 1000,
+    "legendary": 2000,
+    "artifact": 5000,
+    "all": 10000
+}
+
 # Правила улучшения карточек
 UPGRADE_RULES = {
     "common": "rare",
     "rare": "epic",
     "epic": "legendary",
     "legendary": "artifact"
-} 
\ No newline at end of file
+}
+
+# Правила нового сезона: доля опыта, которая переносится, и что делать с карточками
+# каждой редкости ("keep" - оставить, "reset" - обнулить, "unique" - оставить по одной)
+SEASON_RULES = {
+    "xp_carry": 0.1,
+    "cards": {
+        "common": "reset",
+        "rare": "reset",
+        "epic": "unique",
+        "legendary": "keep",
+        "artifact": "keep"
+    }
+}
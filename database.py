@@ -1,15 +1,32 @@
+import asyncio
 import aiosqlite
 import os
-from datetime import datetime
-from typing import List, Dict, Optional
+import secrets
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Dict, Optional
+
+from config import DAILY_COOLDOWN
+from cards import CARD_BITS, CATALOG_FINGERPRINT
+from achievements import Achievement, bits_from_bytes, bits_to_bytes, completed, newly_completed
 
 class Database:
     def __init__(self):
         self.db_path = "bot.db"
+        # Новые достижения, о которых ещё не сообщили пользователю
+        self.new_achievements: Dict[int, List[Achievement]] = {}
+
+    @property
+    def archive_path(self) -> str:
+        """Архив прошедших сезонов: отдельный файл рядом с основной базой, подключается через ATTACH"""
+        return os.path.join(os.path.dirname(self.db_path), "archive.db")
 
     async def init(self):
         """Инициализация базы данных"""
         async with aiosqlite.connect(self.db_path) as db:
+            # WAL позволяет нескольким процессам читать базу во время записи
+            await db.execute("PRAGMA journal_mode=WAL")
+            
             # Создаем таблицу пользователей
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -30,8 +47,194 @@ class Database:
                 )
             """)
             
+            # Создаем таблицу напоминаний (индекс по due_at работает как очередь с приоритетом)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS reminders (
+                    user_id INTEGER PRIMARY KEY,
+                    due_at INTEGER NOT NULL
+                )
+            """)
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_reminders_due_at ON reminders (due_at)"
+            )
+            
+            # Создаем таблицу предложений обмена
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS trade_offers (
+                    offer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    seller_id INTEGER NOT NULL,
+                    give_card TEXT NOT NULL,
+                    want_card TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'open',
+                    buyer_id INTEGER,
+                    created_at TEXT
+                )
+            """)
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_trade_offers_status ON trade_offers (status)"
+            )
+            
+            # Журнал изменений предложений (по нему процессы синхронизируют книгу заявок)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS trade_journal (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    offer_id INTEGER NOT NULL,
+                    event TEXT NOT NULL
+                )
+            """)
+            
+            # Служебные настройки (ключ - значение)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+            
+            # Журнал розыгрышей: по номеру и пользователю восстанавливается сид
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS rng_draws (
+                    draw_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    created_at TEXT,
+                    outcome TEXT
+                )
+            """)
+            
+            # file_id загруженных в Telegram анимаций карточек
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS card_media (
+                    card_name TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL
+                )
+            """)
+            
+            # Битовые наборы коллекций (бит = позиция карточки в каталоге)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS collections (
+                    user_id INTEGER PRIMARY KEY,
+                    bits BLOB NOT NULL
+                )
+            """)
+            
+            # Полученные достижения
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS achievements (
+                    user_id INTEGER,
+                    achievement TEXT,
+                    unlocked_at TEXT,
+                    PRIMARY KEY (user_id, achievement)
+                )
+            """)
+            
+            # Статистика: получения карточек по часам и редкостям
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS stats_claims (
+                    hour TEXT,
+                    rarity TEXT,
+                    claims INTEGER DEFAULT 0,
+                    PRIMARY KEY (hour, rarity)
+                )
+            """)
+            
+            # Статистика: активные пользователи по дням
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS stats_active (
+                    day TEXT,
+                    user_id INTEGER,
+                    PRIMARY KEY (day, user_id)
+                ) WITHOUT ROWID
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS stats_daily (
+                    day TEXT PRIMARY KEY,
+                    dau INTEGER DEFAULT 0
+                )
+            """)
+            
+            # Статистика: самые популярные карточки (обновляется при каждом изменении коллекции)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS stats_cards (
+                    card_name TEXT PRIMARY KEY,
+                    holders INTEGER,
+                    total INTEGER
+                )
+            """)
+            # Раньше таблица пересчитывалась периодически - один раз пересчитываем её при запуске
+            cursor = await db.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('stats_cards_incremental', '1')"
+            )
+            if cursor.rowcount:
+                await db.execute("DELETE FROM stats_cards")
+                await db.execute("""
+                    INSERT INTO stats_cards (card_name, holders, total)
+                    SELECT card_name, COUNT(*), SUM(count)
+                    FROM cards
+                    GROUP BY card_name
+                """)
+            
+            # Новые колонки для уже существующих баз
+            await self._add_column(db, "users", "remind", "INTEGER DEFAULT 0")
+            await self._add_column(db, "users", "blocked", "INTEGER DEFAULT 0")
+            await self._add_column(db, "rng_draws", "seed_id", "TEXT")
+            
+            # Архив сезонов: итоги игроков и их коллекции на конец сезона
+            await self._attach_archive(db)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS archive.seasons (
+                    season INTEGER PRIMARY KEY,
+                    started_at TEXT,
+                    ended_at TEXT,
+                    players INTEGER
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS archive.season_users (
+                    season INTEGER,
+                    user_id INTEGER,
+                    username TEXT,
+                    xp INTEGER,
+                    unique_cards INTEGER,
+                    total_cards INTEGER,
+                    PRIMARY KEY (season, user_id)
+                ) WITHOUT ROWID
+            """)
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS archive.idx_season_users_xp ON season_users (season, xp)"
+            )
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS archive.season_cards (
+                    season INTEGER,
+                    user_id INTEGER,
+                    card_name TEXT,
+                    count INTEGER,
+                    PRIMARY KEY (season, user_id, card_name)
+                ) WITHOUT ROWID
+            """)
+            
+            # Первый сезон начинается с первого запуска
+            await db.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('season', '1')"
+            )
+            await db.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('season_started_at', ?)",
+                (datetime.now().isoformat(),)
+            )
+            
             await db.commit()
 
+    async def _attach_archive(self, db: aiosqlite.Connection):
+        """Подключить архив сезонов к соединению как схему archive"""
+        await db.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+
+    async def _add_column(self, db: aiosqlite.Connection, table: str, column: str, definition: str):
+        """Добавить колонку в таблицу, если её ещё нет"""
+        cursor = await db.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in await cursor.fetchall()]
+        if column not in columns:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """Получить информацию о пользователе"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -49,28 +252,113 @@ class Database:
                 "INSERT OR IGNORE INTO users (user_id, username, xp) VALUES (?, ?, 0)",
                 (user_id, username)
             )
+            # Пользователь снова пишет боту - значит, разблокировал его
+            await db.execute(
+                "UPDATE users SET blocked = 0 WHERE user_id = ? AND blocked = 1",
+                (user_id,)
+            )
             await db.commit()
 
-    async def update_last_daily(self, user_id: int):
-        """Обновить время последнего получения карточки"""
-        now = datetime.now().isoformat()
+    async def mark_blocked(self, user_ids: List[int]):
+        """Отметить пользователей, которые заблокировали бота"""
+        if not user_ids:
+            return
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.executemany(
+                "UPDATE users SET blocked = 1 WHERE user_id = ?",
+                [(user_id,) for user_id in user_ids]
+            )
+            # Напоминания таким пользователям всё равно не доставить
+            await db.executemany(
+                "DELETE FROM reminders WHERE user_id = ?",
+                [(user_id,) for user_id in user_ids]
+            )
+            await db.commit()
+
+    async def get_reachable_users(self) -> List[tuple]:
+        """Пользователи, которые не заблокировали бота: (user_id, username) по возрастанию ID"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "SELECT user_id, username FROM users WHERE blocked = 0 ORDER BY user_id"
+            )
+            return await cursor.fetchall()
+
+    async def update_last_daily(self, user_id: int, rarity: Optional[str] = None):
+        """Обновить время последнего получения карточки и запланировать напоминание"""
+        now = datetime.now()
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute(
-                "UPDATE users SET last_daily = ? WHERE user_id = ?",
-                (now, user_id)
+                "UPDATE users SET last_daily = ?, blocked = 0 WHERE user_id = ?",
+                (now.isoformat(), user_id)
             )
+            await self._schedule_reminder(db, user_id, int(time.time()) + DAILY_COOLDOWN)
+            if rarity:
+                await self._record_claim(db, user_id, rarity, now)
             await db.commit()
 
+    async def _record_claim(self, db: aiosqlite.Connection, user_id: int, rarity: str, now: datetime):
+        """Учесть получение карточки в почасовой и дневной статистике"""
+        await db.execute("""
+            INSERT INTO stats_claims (hour, rarity, claims) VALUES (?, ?, 1)
+            ON CONFLICT(hour, rarity) DO UPDATE SET claims = claims + 1
+        """, (now.strftime("%Y-%m-%dT%H"), rarity))
+        
+        day = now.strftime("%Y-%m-%d")
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO stats_active (day, user_id) VALUES (?, ?)",
+            (day, user_id)
+        )
+        if cursor.rowcount:
+            # Пользователь сегодня активен впервые
+            await db.execute("""
+                INSERT INTO stats_daily (day, dau) VALUES (?, 1)
+                ON CONFLICT(day) DO UPDATE SET dau = dau + 1
+            """, (day,))
+
+    async def _schedule_reminder(self, db: aiosqlite.Connection, user_id: int, due_at: int):
+        """Запланировать напоминание, если пользователь их включил"""
+        await db.execute("""
+            INSERT INTO reminders (user_id, due_at)
+            SELECT user_id, ? FROM users WHERE user_id = ? AND remind = 1
+            ON CONFLICT(user_id) DO UPDATE SET due_at = excluded.due_at
+        """, (due_at, user_id))
+
+    async def set_reminders(self, user_id: int, enabled: bool, due_at: Optional[int] = None):
+        """Включить или выключить напоминания о новой карточке"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE users SET remind = ? WHERE user_id = ?",
+                (int(enabled), user_id)
+            )
+            if enabled and due_at:
+                await self._schedule_reminder(db, user_id, due_at)
+            elif not enabled:
+                await db.execute("DELETE FROM reminders WHERE user_id = ?", (user_id,))
+            await db.commit()
+
+    async def pop_due_reminders(self, now: int, limit: int) -> List[int]:
+        """Забрать из очереди напоминания, время которых наступило"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "SELECT user_id FROM reminders WHERE due_at <= ? ORDER BY due_at LIMIT ?",
+                (now, limit)
+            )
+            user_ids = [row[0] for row in await cursor.fetchall()]
+            if user_ids:
+                await db.executemany(
+                    "DELETE FROM reminders WHERE user_id = ? AND due_at <= ?",
+                    [(user_id, now) for user_id in user_ids]
+                )
+                await db.commit()
+            return user_ids
+
     async def add_card(self, user_id: int, card_name: str) -> int:
         """Добавить карточку пользователю и вернуть новое количество"""
         async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO cards (user_id, card_name, count)
-                VALUES (?, ?, 1)
-                ON CONFLICT(user_id, card_name)
-                DO UPDATE SET count = count + 1
-            """, (user_id, card_name))
+            unlocked = []
+            await self._give_card(db, user_id, card_name, unlocked)
             await db.commit()
+            self._publish_achievements(unlocked)
             
             cursor = await db.execute(
                 "SELECT count FROM cards WHERE user_id = ? AND card_name = ?",
@@ -119,57 +407,724 @@ class Database:
     async def upgrade_cards(self, user_id: int, card_name: str) -> Optional[str]:
         """Улучшить три одинаковые карточки в одну более редкую"""
         async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем количество карточек
-            cursor = await db.execute(
-                "SELECT count FROM cards WHERE user_id = ? AND card_name = ?",
-                (user_id, card_name)
-            )
-            result = await cursor.fetchone()
-            
-            if not result or result[0] < 3:
+            # Уменьшаем количество карточек на 3 (если их хватает)
+            if not await self._take_card(db, user_id, card_name, 3):
                 return None
             
-            # Уменьшаем количество карточек на 3
-            await db.execute("""
-                UPDATE cards 
-                SET count = count - 3 
-                WHERE user_id = ? AND card_name = ?
-            """, (user_id, card_name))
-            
-            # Удаляем запись, если карточек не осталось
-            await db.execute("""
-                DELETE FROM cards 
-                WHERE user_id = ? AND card_name = ? AND count <= 0
-            """, (user_id, card_name))
-            
             await db.commit()
             return card_name
 
+    async def apply_card_plan(self, user_id: int, plan: Callable[[Dict[str, int]], object]):
+        """Рассчитать изменения коллекции и применить их одной транзакцией.
+
+        plan получает текущую коллекцию {карточка: количество} и возвращает
+        объект с полем deltas {карточка: изменение количества}; он же
+        возвращается из метода.
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            # Коллекция читается и меняется под одной блокировкой на запись
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute(
+                    "SELECT card_name, count FROM cards WHERE user_id = ?",
+                    (user_id,)
+                )
+                counts = {card_name: count for card_name, count in await cursor.fetchall()}
+                result = plan(counts)
+                
+                unlocked = []
+                for card_name, delta in result.deltas.items():
+                    if delta < 0:
+                        await self._take_card(db, user_id, card_name, -delta)
+                for card_name, delta in result.deltas.items():
+                    if delta > 0:
+                        await self._give_card(db, user_id, card_name, unlocked, delta)
+                
+                await db.commit()
+                self._publish_achievements(unlocked)
+                return result
+            except Exception:
+                await db.rollback()
+                raise
+
     async def remove_card(self, user_id: int, card_name: str) -> bool:
         """Удалить одну карточку у пользователя"""
         async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем наличие карточки
+            if not await self._take_card(db, user_id, card_name):
+                return False
+            
+            await db.commit()
+            return True
+
+    async def _take_card(self, db: aiosqlite.Connection, user_id: int, card_name: str, amount: int = 1) -> bool:
+        """Забрать карточки у пользователя внутри открытой транзакции"""
+        cursor = await db.execute("""
+            UPDATE cards 
+            SET count = count - ? 
+            WHERE user_id = ? AND card_name = ? AND count >= ?
+        """, (amount, user_id, card_name, amount))
+        if cursor.rowcount == 0:
+            return False
+        
+        # Удаляем запись, если карточек не осталось
+        cursor = await db.execute("""
+            DELETE FROM cards 
+            WHERE user_id = ? AND card_name = ? AND count <= 0
+        """, (user_id, card_name))
+        if cursor.rowcount:
+            await self._update_collection(db, user_id, card_name, False)
+        await self._update_card_stats(db, card_name, -cursor.rowcount, -amount)
+        return True
+
+    async def _give_card(self, db: aiosqlite.Connection, user_id: int, card_name: str,
+                         unlocked: List[tuple], amount: int = 1):
+        """Добавить карточки пользователю внутри открытой транзакции.
+
+        Собранные достижения добавляются в unlocked; сообщать о них можно
+        только после коммита (см. _publish_achievements).
+        """
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO cards (user_id, card_name, count) VALUES (?, ?, ?)",
+            (user_id, card_name, amount)
+        )
+        if cursor.rowcount:
+            # Новая карточка в коллекции
+            await self._update_collection(db, user_id, card_name, True, unlocked)
+            await self._update_card_stats(db, card_name, 1, amount)
+            return
+        
+        await db.execute("""
+            UPDATE cards SET count = count + ?
+            WHERE user_id = ? AND card_name = ?
+        """, (amount, user_id, card_name))
+        await self._update_card_stats(db, card_name, 0, amount)
+
+    async def _update_card_stats(self, db: aiosqlite.Connection, card_name: str, holders: int, total: int):
+        """Учесть изменение коллекции в популярности карточки внутри открытой транзакции"""
+        await db.execute("""
+            INSERT INTO stats_cards (card_name, holders, total) VALUES (?, ?, ?)
+            ON CONFLICT(card_name) DO UPDATE SET
+                holders = holders + excluded.holders,
+                total = total + excluded.total
+        """, (card_name, holders, total))
+
+    async def _update_collection(self, db: aiosqlite.Connection, user_id: int, card_name: str,
+                                 owned: bool, unlocked: Optional[List[tuple]] = None):
+        """Обновить битовый набор коллекции и выдать собранные достижения"""
+        bit = CARD_BITS.get(card_name)
+        if bit is None:
+            return
+        
+        cursor = await db.execute("SELECT bits FROM collections WHERE user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+        old_bits = bits_from_bytes(row[0]) if row else 0
+        new_bits = old_bits | (1 << bit) if owned else old_bits & ~(1 << bit)
+        if new_bits == old_bits:
+            return
+        
+        await db.execute("""
+            INSERT INTO collections (user_id, bits) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET bits = excluded.bits
+        """, (user_id, bits_to_bytes(new_bits)))
+        
+        if owned:
+            for achievement in newly_completed(old_bits, new_bits):
+                await self._unlock_achievement(db, user_id, achievement, unlocked)
+
+    async def _unlock_achievement(self, db: aiosqlite.Connection, user_id: int,
+                                  achievement: Achievement, unlocked: List[tuple]):
+        """Выдать достижение и награду, если его ещё не было"""
+        cursor = await db.execute("""
+            INSERT OR IGNORE INTO achievements (user_id, achievement, unlocked_at)
+            VALUES (?, ?, ?)
+        """, (user_id, achievement.key, datetime.now().isoformat()))
+        if not cursor.rowcount:
+            return
+        
+        await db.execute(
+            "UPDATE users SET xp = xp + ? WHERE user_id = ?",
+            (achievement.xp, user_id)
+        )
+        unlocked.append((user_id, achievement))
+
+    def _publish_achievements(self, unlocked: List[tuple]):
+        """Поставить достижения в очередь уведомлений (только после успешного коммита)"""
+        for user_id, achievement in unlocked:
+            self.new_achievements.setdefault(user_id, []).append(achievement)
+
+    def pop_new_achievements(self, user_id: int) -> List[Achievement]:
+        """Забрать достижения, о которых пользователю ещё не сообщили"""
+        return self.new_achievements.pop(user_id, [])
+
+    async def get_collection_bits(self, user_id: int) -> int:
+        """Получить битовый набор коллекции пользователя"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("SELECT bits FROM collections WHERE user_id = ?", (user_id,))
+            row = await cursor.fetchone()
+            return bits_from_bytes(row[0]) if row else 0
+
+    async def get_achievements(self, user_id: int) -> List[str]:
+        """Получить ключи полученных достижений"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "SELECT achievement FROM achievements WHERE user_id = ? ORDER BY unlocked_at",
+                (user_id,)
+            )
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def backfill_collections(self, batch_size: int = 500) -> int:
+        """Пересчитать битовые наборы и достижения по таблице cards.
+
+        Пользователи обрабатываются порциями по диапазонам user_id. Каждая
+        порция читается и записывается под блокировкой на запись, поэтому
+        бэкфилл можно запускать на работающем боте: изменения коллекций,
+        сделанные между порциями, не перезаписываются устаревшими битами.
+        """
+        users = 0
+        cursor_user_id = -1
+        while True:
+            async with aiosqlite.connect(self.db_path) as db:
+                await db.execute("BEGIN IMMEDIATE")
+                try:
+                    # Следующие batch_size пользователей с карточками (по индексу UNIQUE(user_id, card_name))
+                    cursor = await db.execute(
+                        "SELECT DISTINCT user_id FROM cards WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                        (cursor_user_id, batch_size)
+                    )
+                    user_ids = [row[0] for row in await cursor.fetchall()]
+                    lo = cursor_user_id
+                    hi = user_ids[-1] if user_ids else None
+                    
+                    collections = {}
+                    if user_ids:
+                        cursor = await db.execute(
+                            "SELECT user_id, card_name FROM cards WHERE user_id > ? AND user_id <= ?",
+                            (lo, hi)
+                        )
+                        for user_id, card_name in await cursor.fetchall():
+                            bits = collections.get(user_id, 0)
+                            bit = CARD_BITS.get(card_name)
+                            collections[user_id] = bits | (1 << bit) if bit is not None else bits
+                    
+                    # Бэкфилл не должен слать уведомления за старые коллекции
+                    unlocked = []
+                    for user_id, bits in collections.items():
+                        for achievement in completed(bits):
+                            await self._unlock_achievement(db, user_id, achievement, unlocked)
+                    
+                    # Записи пользователей диапазона без карточек тоже удаляются
+                    if hi is None:
+                        await db.execute("DELETE FROM collections WHERE user_id > ?", (lo,))
+                    else:
+                        await db.execute(
+                            "DELETE FROM collections WHERE user_id > ? AND user_id <= ?", (lo, hi)
+                        )
+                    await db.executemany(
+                        "INSERT INTO collections (user_id, bits) VALUES (?, ?)",
+                        [(user_id, bits_to_bytes(bits)) for user_id, bits in collections.items()]
+                    )
+                    
+                    if hi is None:
+                        await db.execute("""
+                            INSERT INTO meta (key, value) VALUES ('catalog_fingerprint', ?)
+                            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                        """, (CATALOG_FINGERPRINT,))
+                    await db.commit()
+                except Exception:
+                    await db.rollback()
+                    raise
+            
+            if hi is None:
+                return users
+            users += len(user_ids)
+            cursor_user_id = hi
+            # Даём обработчикам взять блокировку между порциями
+            await asyncio.sleep(0)
+
+    async def get_card_count(self, user_id: int, card_name: str) -> int:
+        """Получить количество карточек одного типа у пользователя"""
+        async with aiosqlite.connect(self.db_path) as db:
             cursor = await db.execute(
                 "SELECT count FROM cards WHERE user_id = ? AND card_name = ?",
                 (user_id, card_name)
             )
             result = await cursor.fetchone()
-            
+            return result[0] if result else 0
+
+    async def create_trade_offer(self, seller_id: int, give_card: str, want_card: str) -> Optional[int]:
+        """Создать предложение обмена и вернуть его номер"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "SELECT count FROM cards WHERE user_id = ? AND card_name = ?",
+                (seller_id, give_card)
+            )
+            result = await cursor.fetchone()
             if not result or result[0] < 1:
+                return None
+            
+            cursor = await db.execute("""
+                INSERT INTO trade_offers (seller_id, give_card, want_card, created_at)
+                VALUES (?, ?, ?, ?)
+            """, (seller_id, give_card, want_card, datetime.now().isoformat()))
+            offer_id = cursor.lastrowid
+            await db.execute(
+                "INSERT INTO trade_journal (offer_id, event) VALUES (?, 'open')",
+                (offer_id,)
+            )
+            await db.commit()
+            return offer_id
+
+    async def cancel_trade_offer(self, offer_id: int, seller_id: int) -> bool:
+        """Отменить своё открытое предложение обмена"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("""
+                UPDATE trade_offers SET status = 'cancelled'
+                WHERE offer_id = ? AND seller_id = ? AND status = 'open'
+            """, (offer_id, seller_id))
+            if cursor.rowcount == 0:
                 return False
             
-            # Уменьшаем количество карточек на 1
+            await db.execute(
+                "INSERT INTO trade_journal (offer_id, event) VALUES (?, 'cancelled')",
+                (offer_id,)
+            )
+            await db.commit()
+            return True
+
+    async def execute_trade(self, offer_id: int, buyer_id: int,
+                            cancel_offer_id: Optional[int] = None) -> Optional[Dict]:
+        """Провести обмен по предложению одной транзакцией.
+
+        cancel_offer_id - встречное предложение покупателя, которое закрывается
+        этим обменом: оно отменяется в той же транзакции, а если оно уже
+        исполнено или отменено, обмен не проводится.
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            # Сразу берём блокировку на запись, чтобы два обмена не прошли одновременно
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute(
+                    "SELECT * FROM trade_offers WHERE offer_id = ? AND status = 'open'",
+                    (offer_id,)
+                )
+                offer = await cursor.fetchone()
+                if not offer or offer['seller_id'] == buyer_id:
+                    await db.rollback()
+                    return None
+                
+                if cancel_offer_id is not None:
+                    cursor = await db.execute("""
+                        UPDATE trade_offers SET status = 'cancelled'
+                        WHERE offer_id = ? AND seller_id = ? AND status = 'open'
+                    """, (cancel_offer_id, buyer_id))
+                    if cursor.rowcount == 0:
+                        await db.rollback()
+                        return None
+                    await db.execute(
+                        "INSERT INTO trade_journal (offer_id, event) VALUES (?, 'cancelled')",
+                        (cancel_offer_id,)
+                    )
+                
+                if not await self._take_card(db, offer['seller_id'], offer['give_card']):
+                    # У продавца больше нет карточки - предложение неактуально
+                    await db.rollback()
+                    await self.cancel_trade_offer(offer_id, offer['seller_id'])
+                    return None
+                
+                if not await self._take_card(db, buyer_id, offer['want_card']):
+                    await db.rollback()
+                    return None
+                
+                unlocked = []
+                await self._give_card(db, offer['seller_id'], offer['want_card'], unlocked)
+                await self._give_card(db, buyer_id, offer['give_card'], unlocked)
+                
+                await db.execute(
+                    "UPDATE trade_offers SET status = 'done', buyer_id = ? WHERE offer_id = ?",
+                    (buyer_id, offer_id)
+                )
+                await db.execute(
+                    "INSERT INTO trade_journal (offer_id, event) VALUES (?, 'done')",
+                    (offer_id,)
+                )
+                await db.commit()
+                self._publish_achievements(unlocked)
+                return offer
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def get_open_trade_offers(self) -> tuple[List[Dict], int]:
+        """Получить все открытые предложения и номер последней записи журнала"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            # Читаем одним снимком, чтобы журнал и предложения совпадали
+            await db.execute("BEGIN")
+            cursor = await db.execute("SELECT COALESCE(MAX(seq), 0) FROM trade_journal")
+            last_seq = (await cursor.fetchone())[0]
+            cursor = await db.execute(
+                "SELECT * FROM trade_offers WHERE status = 'open' ORDER BY offer_id"
+            )
+            offers = await cursor.fetchall()
+            await db.rollback()
+            return offers, last_seq
+
+    async def get_trade_events(self, after_seq: int) -> List[Dict]:
+        """Получить записи журнала обменов после указанной"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT j.seq, j.event, o.offer_id, o.seller_id, o.give_card, o.want_card
+                FROM trade_journal j
+                JOIN trade_offers o ON o.offer_id = j.offer_id
+                WHERE j.seq > ?
+                ORDER BY j.seq
+            """, (after_seq,))
+            return await cursor.fetchall()
+
+    async def get_meta(self, key: str) -> Optional[str]:
+        """Получить служебное значение"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("SELECT value FROM meta WHERE key = ?", (key,))
+            result = await cursor.fetchone()
+            return result[0] if result else None
+
+    async def set_meta(self, key: str, value: str):
+        """Сохранить служебное значение"""
+        async with aiosqlite.connect(self.db_path) as db:
             await db.execute("""
-                UPDATE cards 
-                SET count = count - 1 
-                WHERE user_id = ? AND card_name = ?
-            """, (user_id, card_name))
+                INSERT INTO meta (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """, (key, value))
+            await db.commit()
+
+    async def get_season(self) -> int:
+        """Номер текущего сезона"""
+        return int(await self.get_meta("season") or 1)
+
+    async def begin_season_rollover(self, admin_id: int) -> Optional[int]:
+        """Начать завершение текущего сезона; None, если оно уже идёт"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("SELECT value FROM meta WHERE key = 'season'")
+            season = int((await cursor.fetchone())[0])
+            # INSERT OR IGNORE: два одновременных /endseason не запустят переход дважды
+            cursor = await db.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('rollover_season', ?)",
+                (str(season),)
+            )
+            if not cursor.rowcount:
+                await db.rollback()
+                return None
             
-            # Удаляем запись, если карточек не осталось
+            await db.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [("rollover_cursor", "0"), ("rollover_admin", str(admin_id))]
+            )
+            await db.commit()
+            return season
+
+    async def get_season_rollover(self) -> Optional[Dict]:
+        """Состояние незавершённого перехода сезона: номер, курсор и кто его начал"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("""
+                SELECT key, value FROM meta
+                WHERE key IN ('rollover_season', 'rollover_cursor', 'rollover_admin')
+            """)
+            state = {key: int(value) for key, value in await cursor.fetchall()}
+            if "rollover_season" not in state:
+                return None
+            return {
+                "season": state["rollover_season"],
+                "cursor": state.get("rollover_cursor", 0),
+                "admin_id": state.get("rollover_admin")
+            }
+
+    async def rollover_season_chunk(self, season: int, after_user_id: int, limit: int,
+                                    xp_carry: float, reset_cards: List[str],
+                                    unique_cards: List[str]) -> Optional[int]:
+        """Заархивировать и сбросить следующую порцию пользователей.
+
+        Возвращает ID последнего обработанного пользователя или None, если
+        пользователей больше нет. В режиме WAL коммит сразу в два файла не
+        атомарен, поэтому сначала отдельной транзакцией фиксируется архив,
+        а затем в bot.db - сброс и курсор. Если процесс упадёт между ними,
+        порция будет заархивирована повторно (INSERT OR REPLACE) и ничего
+        не потеряется.
+        """
+        async with aiosqlite.connect(self.db_path) as db, \
+                aiosqlite.connect(self.archive_path) as archive:
+            # Блокировка на запись держится до конца, чтобы архив и сброс видели одни данные
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute(
+                    "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                    (after_user_id, limit)
+                )
+                user_ids = [row[0] for row in await cursor.fetchall()]
+                if not user_ids:
+                    await db.rollback()
+                    return None
+                
+                # Диапазон (lo, hi] по первичному ключу вместо длинного списка ID
+                lo, hi = after_user_id, user_ids[-1]
+                
+                cursor = await db.execute("""
+                    SELECT ?, u.user_id, u.username, u.xp, COUNT(c.card_name), COALESCE(SUM(c.count), 0)
+                    FROM users u
+                    LEFT JOIN cards c ON c.user_id = u.user_id
+                    WHERE u.user_id > ? AND u.user_id <= ?
+                    GROUP BY u.user_id
+                """, (season, lo, hi))
+                season_users = await cursor.fetchall()
+                cursor = await db.execute("""
+                    SELECT ?, user_id, card_name, count FROM cards
+                    WHERE user_id > ? AND user_id <= ?
+                """, (season, lo, hi))
+                season_cards = await cursor.fetchall()
+                
+                await archive.executemany("""
+                    INSERT OR REPLACE INTO season_users
+                        (season, user_id, username, xp, unique_cards, total_cards)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, season_users)
+                await archive.executemany("""
+                    INSERT OR REPLACE INTO season_cards (season, user_id, card_name, count)
+                    VALUES (?, ?, ?, ?)
+                """, season_cards)
+                await archive.commit()
+                
+                await db.execute(
+                    "UPDATE users SET xp = CAST(xp * ? AS INTEGER) WHERE user_id > ? AND user_id <= ?",
+                    (xp_carry, lo, hi)
+                )
+                if unique_cards:
+                    placeholders = ",".join("?" * len(unique_cards))
+                    cursor = await db.execute(f"""
+                        SELECT card_name, SUM(count - 1) FROM cards
+                        WHERE user_id > ? AND user_id <= ? AND count > 1
+                          AND card_name IN ({placeholders})
+                        GROUP BY card_name
+                    """, (lo, hi, *unique_cards))
+                    for card_name, removed in await cursor.fetchall():
+                        await self._update_card_stats(db, card_name, 0, -removed)
+                    await db.execute(f"""
+                        UPDATE cards SET count = 1
+                        WHERE user_id > ? AND user_id <= ? AND count > 1
+                          AND card_name IN ({placeholders})
+                    """, (lo, hi, *unique_cards))
+                if reset_cards:
+                    await self._reset_cards(db, lo, hi, reset_cards)
+                
+                await db.execute(
+                    "UPDATE meta SET value = ? WHERE key = 'rollover_cursor'",
+                    (str(hi),)
+                )
+                await db.commit()
+                return hi
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def _reset_cards(self, db: aiosqlite.Connection, lo: int, hi: int, card_names: List[str]):
+        """Забрать карточки у пользователей диапазона (lo, hi] внутри открытой транзакции"""
+        placeholders = ",".join("?" * len(card_names))
+        
+        # Предложения обмена на сброшенные карточки больше не выполнить
+        cursor = await db.execute(f"""
+            SELECT offer_id FROM trade_offers
+            WHERE status = 'open' AND seller_id > ? AND seller_id <= ?
+              AND give_card IN ({placeholders})
+        """, (lo, hi, *card_names))
+        offer_ids = [(row[0],) for row in await cursor.fetchall()]
+        if offer_ids:
+            await db.executemany(
+                "UPDATE trade_offers SET status = 'cancelled' WHERE offer_id = ?", offer_ids
+            )
+            await db.executemany(
+                "INSERT INTO trade_journal (offer_id, event) VALUES (?, 'cancelled')", offer_ids
+            )
+        
+        cursor = await db.execute(f"""
+            SELECT card_name, COUNT(*), SUM(count) FROM cards
+            WHERE user_id > ? AND user_id <= ? AND card_name IN ({placeholders})
+            GROUP BY card_name
+        """, (lo, hi, *card_names))
+        for card_name, holders, total in await cursor.fetchall():
+            await self._update_card_stats(db, card_name, -holders, -total)
+        
+        await db.execute(f"""
+            DELETE FROM cards
+            WHERE user_id > ? AND user_id <= ? AND card_name IN ({placeholders})
+        """, (lo, hi, *card_names))
+        
+        # Пересобираем битовые наборы коллекций (достижения остаются навсегда)
+        cursor = await db.execute(
+            "SELECT user_id, card_name FROM cards WHERE user_id > ? AND user_id <= ?",
+            (lo, hi)
+        )
+        collections = {}
+        for user_id, card_name in await cursor.fetchall():
+            bit = CARD_BITS.get(card_name)
+            if bit is not None:
+                collections[user_id] = collections.get(user_id, 0) | (1 << bit)
+        await db.execute(
+            "DELETE FROM collections WHERE user_id > ? AND user_id <= ?", (lo, hi)
+        )
+        await db.executemany(
+            "INSERT INTO collections (user_id, bits) VALUES (?, ?)",
+            [(user_id, bits_to_bytes(bits)) for user_id, bits in collections.items()]
+        )
+
+    async def finish_season(self, season: int) -> int:
+        """Записать итоги сезона в архив, начать следующий и вернуть число игроков"""
+        now = datetime.now().isoformat()
+        started_at = await self.get_meta("season_started_at")
+        
+        # Как и в rollover_season_chunk: сначала архив, потом bot.db
+        async with aiosqlite.connect(self.archive_path) as archive:
+            await archive.execute("""
+                INSERT OR REPLACE INTO seasons (season, started_at, ended_at, players)
+                SELECT ?, ?, ?, (SELECT COUNT(*) FROM season_users WHERE season = ?)
+            """, (season, started_at, now, season))
+            await archive.commit()
+            cursor = await archive.execute(
+                "SELECT players FROM seasons WHERE season = ?", (season,)
+            )
+            players = (await cursor.fetchone())[0]
+        
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [("season", str(season + 1)), ("season_started_at", now)]
+            )
             await db.execute("""
-                DELETE FROM cards 
-                WHERE user_id = ? AND card_name = ? AND count <= 0
-            """, (user_id, card_name))
-            
+                DELETE FROM meta
+                WHERE key IN ('rollover_season', 'rollover_cursor', 'rollover_admin')
+            """)
+            await db.commit()
+        return players
+
+    async def get_seasons(self) -> List[Dict]:
+        """Прошедшие сезоны из архива"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await self._attach_archive(db)
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("SELECT * FROM archive.seasons ORDER BY season")
+            return await cursor.fetchall()
+
+    async def get_season_leaderboard(self, season: int) -> List[Dict]:
+        """Таблица лидеров прошедшего сезона из архива"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await self._attach_archive(db)
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute("""
+                SELECT username, xp, unique_cards, total_cards
+                FROM archive.season_users
+                WHERE season = ?
+                ORDER BY xp DESC
+                LIMIT 10
+            """, (season,))
+            return await cursor.fetchall()
+
+    async def get_rng_seed(self) -> str:
+        """Получить общий сид генератора, создав его при первом запуске"""
+        async with aiosqlite.connect(self.db_path) as db:
+            # INSERT OR IGNORE: если несколько процессов стартуют одновременно, сид будет один
+            await db.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('rng_seed', ?)",
+                (secrets.token_hex(32),)
+            )
+            await db.commit()
+            cursor = await db.execute("SELECT value FROM meta WHERE key = 'rng_seed'")
+            return (await cursor.fetchone())[0]
+
+    async def create_draw(self, user_id: int, kind: str, seed_id: str) -> int:
+        """Зарегистрировать розыгрыш и вернуть его номер"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "INSERT INTO rng_draws (user_id, kind, created_at, seed_id) VALUES (?, ?, ?, ?)",
+                (user_id, kind, datetime.now().isoformat(), seed_id)
+            )
             await db.commit()
-            return True 
\ No newline at end of file
+            return cursor.lastrowid
+
+    async def save_draw_outcome(self, draw_id: int, outcome: str):
+        """Сохранить результат розыгрыша"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE rng_draws SET outcome = ? WHERE draw_id = ?",
+                (outcome, draw_id)
+            )
+            await db.commit()
+
+    async def get_draw(self, draw_id: int) -> Optional[Dict]:
+        """Получить запись журнала розыгрышей"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(
+                "SELECT * FROM rng_draws WHERE draw_id = ?",
+                (draw_id,)
+            )
+            return await cursor.fetchone()
+
+    async def get_card_file_ids(self) -> List[tuple]:
+        """Получить сохранённые file_id анимаций карточек"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute("SELECT card_name, file_id FROM card_media")
+            return await cursor.fetchall()
+
+    async def set_card_file_id(self, card_name: str, file_id: str):
+        """Сохранить file_id анимации карточки"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute("""
+                INSERT INTO card_media (card_name, file_id) VALUES (?, ?)
+                ON CONFLICT(card_name) DO UPDATE SET file_id = excluded.file_id
+            """, (card_name, file_id))
+            await db.commit()
+
+    async def prune_stats(self, keep_days: int = 2):
+        """Удалить старые записи активности"""
+        async with aiosqlite.connect(self.db_path) as db:
+            # Для DAU нужны только последние дни, остальное уже в stats_daily
+            oldest_day = (datetime.now() - timedelta(days=keep_days)).strftime("%Y-%m-%d")
+            await db.execute("DELETE FROM stats_active WHERE day < ?", (oldest_day,))
+            await db.commit()
+
+    async def get_stats(self, hours: int = 12, days: int = 7) -> Dict:
+        """Получить статистику из сводных таблиц"""
+        now = datetime.now()
+        since_hour = (now - timedelta(hours=hours - 1)).strftime("%Y-%m-%dT%H")
+        since_day = (now - timedelta(days=days)).strftime("%Y-%m-%dT%H")
+        
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(
+                "SELECT day, dau FROM stats_daily ORDER BY day DESC LIMIT 2"
+            )
+            dau = await cursor.fetchall()
+            
+            cursor = await db.execute("""
+                SELECT hour, SUM(claims) AS claims FROM stats_claims
+                WHERE hour >= ? GROUP BY hour ORDER BY hour
+            """, (since_hour,))
+            claims_by_hour = await cursor.fetchall()
+            
+            cursor = await db.execute("""
+                SELECT rarity, SUM(claims) AS claims FROM stats_claims
+                WHERE hour >= ? GROUP BY rarity
+            """, (since_day,))
+            claims_by_rarity = await cursor.fetchall()
+            
+            cursor = await db.execute(
+                "SELECT card_name, holders, total FROM stats_cards WHERE holders > 0 ORDER BY total DESC LIMIT 10"
+            )
+            top_cards = await cursor.fetchall()
+            
+            return {
+                "dau": dau,
+                "claims_by_hour": claims_by_hour,
+                "claims_by_rarity": claims_by_rarity,
+                "top_cards": top_cards
+            }
@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from config import DIAGNOSTICS_ENABLED, SLOW_HANDLER_MS
+from tasks import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять задержку цикла событий (в секундах)
+LOOP_LAG_INTERVAL = 0.5
+
+# Задержка цикла событий, о которой стоит написать в лог (в миллисекундах)
+LOOP_LAG_WARNING_MS = 100
+
+# Ограничения профилировщика
+PROFILE_MAX_SECONDS = 60
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Разбивка времени текущего обработчика по шагам: вид -> [время, количество]
+_trace: ContextVar[Optional[Dict[str, list]]] = ContextVar("trace", default=None)
+
+# Вид шага, который сейчас измеряется (чтобы не считать вложенные вызовы дважды)
+_active_kind: ContextVar[Optional[str]] = ContextVar("active_kind", default=None)
+
+def _record(kind: str, elapsed: float):
+    trace = _trace.get()
+    if trace is not None:
+        entry = trace.setdefault(kind, [0.0, 0])
+        entry[0] += elapsed
+        entry[1] += 1
+
+@contextmanager
+def measure(kind: str):
+    """Учесть время блока в разбивке текущего обработчика"""
+    if _trace.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(kind, time.perf_counter() - start)
+
+def traced(callback):
+    """Обернуть обработчик: при превышении SLOW_HANDLER_MS записать разбивку в лог.
+
+    Если диагностика выключена, возвращает обработчик без изменений.
+    """
+    if not DIAGNOSTICS_ENABLED:
+        return callback
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        trace = {}
+        token = _trace.set(trace)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            total = (time.perf_counter() - start) * 1000
+            _trace.reset(token)
+            if total >= SLOW_HANDLER_MS:
+                steps = ", ".join(
+                    f"{kind}={elapsed * 1000:.0f}мс ({count})"
+                    for kind, (elapsed, count) in sorted(trace.items())
+                )
+                accounted = sum(elapsed for elapsed, _ in trace.values()) * 1000
+                logger.warning(
+                    f"Медленный обработчик {callback.__name__}: {total:.0f}мс "
+                    f"[{steps}, остальное={total - accounted:.0f}мс]"
+                )
+
+    return wrapper
+
+def instrument(cls, kind: str):
+    """Учитывать время публичных async-методов класса как шаг kind.
+
+    Если диагностика выключена, класс не меняется.
+    """
+    if not DIAGNOSTICS_ENABLED:
+        return
+
+    for name, method in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(method):
+            continue
+
+        def wrap(method):
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                # Вложенные вызовы того же вида не считаем дважды
+                if _trace.get() is None or _active_kind.get() == kind:
+                    return await method(*args, **kwargs)
+                token = _active_kind.set(kind)
+                start = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    _active_kind.reset(token)
+                    _record(kind, time.perf_counter() - start)
+            return wrapper
+
+        setattr(cls, name, wrap(method))
+
+class LoopLagMonitor(BackgroundTask):
+    """Следит за задержкой цикла событий: насколько позже запланированного просыпается задача"""
+
+    def __init__(self):
+        super().__init__()
+        self.max_lag_ms = 0.0
+
+    def start(self):
+        """Запустить мониторинг (только при включённой диагностике)"""
+        if DIAGNOSTICS_ENABLED:
+            super().start()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag_ms = (loop.time() - expected) * 1000
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            if lag_ms >= LOOP_LAG_WARNING_MS:
+                logger.warning(f"Цикл событий заблокирован на {lag_ms:.0f}мс")
+
+def sample_stacks(thread_id: int, seconds: float) -> str:
+    """Семплировать стек потока и вернуть его в свёрнутом формате flamegraph.
+
+    Каждая строка - "модуль:функция;...;модуль:функция количество", такой
+    файл понимают flamegraph.pl и speedscope. Вызывать из отдельного потока.
+    """
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if names:
+            stacks[";".join(reversed(names))] += 1
+        time.sleep(PROFILE_SAMPLE_INTERVAL)
+
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+async def profile_loop(seconds: float) -> str:
+    """Профилировать поток цикла событий seconds секунд, не блокируя его"""
+    return await asyncio.to_thread(sample_stacks, threading.get_ident(), seconds)
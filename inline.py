@@ -0,0 +1,79 @@
+from typing import Dict, List, Optional, Tuple
+
+from telegram import InlineQueryResult, InlineQueryResultArticle, InlineQueryResultCachedMpeg4Gif, InputTextMessageContent
+
+from cards import CARDS, CARD_CAPTIONS, search_cards
+from database import Database
+
+# Сколько результатов отдавать за один запрос (максимум Telegram - 50)
+INLINE_PAGE_SIZE = 50
+
+# Сколько секунд Telegram может кэшировать ответ
+INLINE_CACHE_TIME = 300
+
+class CardMediaCache:
+    """file_id загруженных анимаций и готовые результаты для inline-режима.
+
+    После первой отправки карточки Telegram возвращает file_id, который
+    сохраняется в базе. Дальше карточка отправляется без повторной загрузки,
+    а inline-результаты строятся один раз при появлении file_id.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.file_ids: Dict[str, str] = {}
+        self.results: Dict[str, InlineQueryResult] = {}
+        # Короткий стабильный ID результата - позиция карточки в каталоге
+        self._result_ids = {card_name: f"c{i}" for i, card_name in enumerate(CARDS)}
+        self._loaded = False
+
+        for card_name in CARDS:
+            self.results[card_name] = self._build_result(card_name)
+
+    def _build_result(self, card_name: str) -> InlineQueryResult:
+        caption = CARD_CAPTIONS[card_name].info.strip()
+        file_id = self.file_ids.get(card_name)
+        if file_id:
+            return InlineQueryResultCachedMpeg4Gif(
+                id=self._result_ids[card_name],
+                mpeg4_file_id=file_id,
+                title=card_name,
+                caption=caption
+            )
+        # Анимация ещё ни разу не загружалась - отдаём текстовую карточку
+        return InlineQueryResultArticle(
+            id=self._result_ids[card_name],
+            title=card_name,
+            description=CARDS[card_name]['description'],
+            input_message_content=InputTextMessageContent(caption)
+        )
+
+    async def load(self):
+        """Загрузить сохранённые file_id (один раз на процесс)"""
+        if self._loaded:
+            return
+        for card_name, file_id in await self.db.get_card_file_ids():
+            if card_name in CARDS:
+                self.file_ids[card_name] = file_id
+                self.results[card_name] = self._build_result(card_name)
+        self._loaded = True
+
+    def get_file_id(self, card_name: Optional[str]) -> Optional[str]:
+        """file_id анимации карточки, если она уже загружалась"""
+        return self.file_ids.get(card_name) if card_name else None
+
+    async def set_file_id(self, card_name: str, file_id: str):
+        """Запомнить file_id после загрузки анимации"""
+        if self.file_ids.get(card_name) == file_id:
+            return
+        self.file_ids[card_name] = file_id
+        self.results[card_name] = self._build_result(card_name)
+        await self.db.set_card_file_id(card_name, file_id)
+
+    def search(self, query: str, offset: str) -> Tuple[List[InlineQueryResult], str]:
+        """Результаты для inline-запроса и смещение следующей страницы"""
+        names = search_cards(query)
+        start = int(offset) if offset.isdigit() else 0
+        end = start + INLINE_PAGE_SIZE
+        results = [self.results[card_name] for card_name in names[start:end]]
+        return results, str(end) if end < len(names) else ""
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+
+from telegram import Bot
+from telegram.error import Forbidden, TelegramError
+
+from database import Database
+from tasks import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять очередь напоминаний (в секундах)
+REMINDER_POLL_INTERVAL = 30
+
+# Сколько напоминаний забирать из базы за один запрос
+REMINDER_BATCH_SIZE = 500
+
+REMINDER_TEXT = "🔔 Новая карточка уже ждёт! Используйте /dailycard"
+
+class ReminderScheduler(BackgroundTask):
+    """Фоновая рассылка напоминаний о том, что кулдаун закончился.
+
+    Очередь хранится в таблице reminders с индексом по времени срабатывания,
+    поэтому переживает перезапуск и не держит напоминания в памяти.
+    """
+
+    def __init__(self, db: Database):
+        super().__init__()
+        self.db = db
+
+    async def _run(self, bot: Bot):
+        while True:
+            try:
+                user_ids = await self.db.pop_due_reminders(int(time.time()), REMINDER_BATCH_SIZE)
+            except Exception as e:
+                logger.error(f"Ошибка при чтении напоминаний: {e}")
+                user_ids = []
+
+            blocked = []
+            for user_id in user_ids:
+                try:
+                    await bot.send_message(chat_id=user_id, text=REMINDER_TEXT)
+                except Forbidden:
+                    blocked.append(user_id)
+                except TelegramError as e:
+                    logger.error(f"Не удалось отправить напоминание {user_id}: {e}")
+
+            try:
+                await self.db.mark_blocked(blocked)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении заблокировавших бота: {e}")
+
+            # Если очередь разобрана не полностью, сразу берём следующую пачку
+            if len(user_ids) < REMINDER_BATCH_SIZE:
+                await asyncio.sleep(REMINDER_POLL_INTERVAL)
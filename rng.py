@@ -0,0 +1,210 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import struct
+import sys
+from typing import Dict, List, Optional, Sequence
+
+from cards import CARDS, CARDS_BY_RARITY, RARITIES, get_random_card, plan_upgrades
+from config import RNG_SEED
+from database import Database
+
+class DrawStream:
+    """Детерминированный поток случайных чисел.
+
+    Счётчиковый генератор: i-е число - это BLAKE2b(i) с ключом потока,
+    поэтому поток полностью задаётся ключом и не имеет общего состояния.
+    Интерфейс повторяет нужную часть модуля random.
+    """
+
+    def __init__(self, key: bytes):
+        self._key = key
+        self._counter = 0
+
+    def _next_u64(self) -> int:
+        digest = hashlib.blake2b(
+            struct.pack("<Q", self._counter),
+            key=self._key,
+            digest_size=8
+        ).digest()
+        self._counter += 1
+        return int.from_bytes(digest, "little")
+
+    def random(self) -> float:
+        """Число в диапазоне [0, 1)"""
+        return (self._next_u64() >> 11) * (1.0 / (1 << 53))
+
+    def randbelow(self, n: int) -> int:
+        """Целое число в диапазоне [0, n) без смещения"""
+        limit = (1 << 64) - (1 << 64) % n
+        while True:
+            value = self._next_u64()
+            if value < limit:
+                return value % n
+
+    def choice(self, seq: Sequence):
+        """Случайный элемент последовательности"""
+        return seq[self.randbelow(len(seq))]
+
+    def choices(self, population: Sequence, weights: Optional[Sequence[float]] = None, k: int = 1) -> List:
+        """k элементов с возвращением с учётом весов"""
+        if weights is None:
+            return [self.choice(population) for _ in range(k)]
+        cum_weights = list(itertools.accumulate(weights))
+        total = cum_weights[-1]
+        hi = len(population) - 1
+        return [
+            population[bisect.bisect(cum_weights, self.random() * total, 0, hi)]
+            for _ in range(k)
+        ]
+
+    def sample(self, population: Sequence, k: int) -> List:
+        """k различных элементов (частичное перемешивание Фишера-Йейтса)"""
+        pool = list(population)
+        n = len(pool)
+        for i in range(k):
+            j = i + self.randbelow(n - i)
+            pool[i], pool[j] = pool[j], pool[i]
+        return pool[:k]
+
+class Draw:
+    """Один розыгрыш (получение карточки, улучшение, раздача) и его результат"""
+
+    def __init__(self, service: "RngService", user_id: int, draw_id: int, kind: str):
+        self.service = service
+        self.user_id = user_id
+        self.draw_id = draw_id
+        self.kind = kind
+        self.outcome: Dict = {}
+
+    def stream(self, purpose: str) -> DrawStream:
+        """Поток для отдельной части розыгрыша"""
+        return self.service.stream(self.user_id, self.draw_id, purpose)
+
+    async def save(self):
+        """Записать результат в журнал"""
+        await self.service.db.save_draw_outcome(self.draw_id, json.dumps(self.outcome, ensure_ascii=False))
+
+class RngService:
+    """Выдача воспроизводимых потоков случайных чисел.
+
+    Ключ потока выводится из общего сида, ID пользователя, номера
+    розыгрыша и назначения, поэтому в журнал пишется только номер
+    розыгрыша и результат - сид каждого розыгрыша восстанавливается.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._seed: Optional[bytes] = None
+        # Короткий отпечаток сида, который записывается в журнал с каждым розыгрышем
+        self.seed_id: Optional[str] = None
+
+    async def init(self):
+        """Загрузить общий сид (из RNG_SEED или из базы)"""
+        if RNG_SEED:
+            seed = RNG_SEED
+        else:
+            seed = await self.db.get_rng_seed()
+        self._seed = hashlib.blake2b(seed.encode(), digest_size=32).digest()
+        self.seed_id = hashlib.blake2b(self._seed, digest_size=8).hexdigest()
+
+    def stream(self, user_id: int, draw_id: int, purpose: str) -> DrawStream:
+        """Поток для пользователя, номера розыгрыша и назначения"""
+        key = hashlib.blake2b(
+            struct.pack("<qq", user_id, draw_id) + purpose.encode(),
+            key=self._seed,
+            digest_size=32
+        ).digest()
+        return DrawStream(key)
+
+    async def open_draw(self, user_id: int, kind: str) -> Draw:
+        """Зарегистрировать новый розыгрыш"""
+        if self._seed is None:
+            await self.init()
+        draw_id = await self.db.create_draw(user_id, kind, self.seed_id)
+        return Draw(self, user_id, draw_id, kind)
+
+    def replay(self, user_id: int, draw_id: int, kind: str, outcome: Dict) -> Dict:
+        """Пересчитать розыгрыш по его номеру и сохранённому результату"""
+        draw = Draw(self, user_id, draw_id, kind)
+        result = {}
+
+        if kind == "daily":
+            card_name, card_info = get_random_card(draw.stream("card"))
+            result["card"] = card_name
+            if card_info["rarity"] == "artifact":
+                if draw.stream("artifact").random() < 0.5:
+                    result["artifact"] = "bonus"
+                    result["bonus"] = get_random_card(draw.stream("artifact_bonus"))[0]
+                else:
+                    result["artifact"] = "loss"
+                    if "owned" in outcome:
+                        result["lost_index"] = draw.stream("artifact_loss").randbelow(outcome["owned"])
+            if "newbie" in outcome:
+                result["newbie"] = get_random_card(draw.stream("newbie"))[0]
+
+        elif kind == "upgrade":
+            next_rarity = RARITIES[CARDS[outcome["from"]]["rarity"]].next_rarity
+            result["card"] = draw.stream("card").choice(CARDS_BY_RARITY[next_rarity])
+
+        elif kind == "upgrade_all":
+            plan = plan_upgrades(outcome["inventory"], draw.stream("cards"), outcome["rarity"])
+            result["gained"] = plan.gained
+
+        elif kind == "massgift":
+            result["winner_indices"] = draw.stream("winners").sample(
+                range(outcome["population"]), len(outcome["winner_indices"])
+            )
+
+        return result
+
+    async def replay_draw(self, draw_id: int) -> Optional[Dict]:
+        """Найти розыгрыш в журнале и пересчитать его.
+
+        Возвращает запись журнала, сохранённый и пересчитанный результат и
+        признак совпадения. Если розыгрыш сделан с другим сидом (например,
+        с RNG_SEED нагрузочного теста), бросает ValueError.
+        """
+        row = await self.db.get_draw(draw_id)
+        if not row:
+            return None
+        if self._seed is None:
+            await self.init()
+        # У розыгрышей, записанных до появления отпечатка, сид не проверить
+        if row["seed_id"] and row["seed_id"] != self.seed_id:
+            raise ValueError(
+                f"Розыгрыш #{draw_id} сделан с другим сидом ({row['seed_id']}, "
+                f"сейчас {self.seed_id}). Пересчитайте его с тем же RNG_SEED"
+            )
+
+        stored = json.loads(row["outcome"] or "{}")
+        replayed = self.replay(row["user_id"], row["draw_id"], row["kind"], stored)
+        return {
+            "draw": row,
+            "stored": stored,
+            "replayed": replayed,
+            "match": all(stored.get(key) == value for key, value in replayed.items())
+        }
+
+if __name__ == "__main__":
+    # Воспроизведение розыгрыша из консоли: python rng.py <номер>
+    if len(sys.argv) != 2:
+        print("Использование: python rng.py <номер розыгрыша>")
+        sys.exit(1)
+
+    try:
+        report = asyncio.run(RngService(Database()).replay_draw(int(sys.argv[1])))
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if not report:
+        print("Розыгрыш не найден")
+        sys.exit(1)
+
+    print(f"Розыгрыш #{report['draw']['draw_id']} ({report['draw']['kind']}), "
+          f"пользователь {report['draw']['user_id']}, {report['draw']['created_at']}")
+    print(f"Сохранено:   {json.dumps(report['stored'], ensure_ascii=False)}")
+    print(f"Пересчитано: {json.dumps(report['replayed'], ensure_ascii=False)}")
+    print("✅ Совпадает" if report["match"] else "❌ Не совпадает")
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from typing import Dict, List
+
+from telegram import Bot
+
+from cards import CARDS_BY_RARITY
+from config import SEASON_RULES
+from database import Database
+from tasks import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+# Сколько пользователей архивировать за одну транзакцию
+SEASON_CHUNK_SIZE = 500
+
+# Пауза между порциями, чтобы команды игроков не ждали блокировку базы (в секундах)
+SEASON_CHUNK_PAUSE = 0.05
+
+# Как часто проверять, не начал ли кто-то переход сезона (в секундах)
+SEASON_POLL_INTERVAL = 30
+
+def cards_by_rule(rules: Dict) -> Dict[str, List[str]]:
+    """Карточки, к которым применяется каждое правило сброса"""
+    result = {"keep": [], "reset": [], "unique": []}
+    for rarity, card_names in CARDS_BY_RARITY.items():
+        result[rules["cards"].get(rarity, "keep")].extend(card_names)
+    return result
+
+class SeasonManager(BackgroundTask):
+    """Фоновый переход на новый сезон без остановки бота.
+
+    /endseason только отмечает начало перехода в таблице meta, а эта задача
+    порциями по user_id переносит опыт и коллекции в архив и сбрасывает
+    живые таблицы по правилам SEASON_RULES. Курсор сохраняется вместе с
+    каждой порцией, поэтому после перезапуска переход продолжается с места
+    остановки, а при шардировании его выполняет один процесс.
+    """
+
+    def __init__(self, db: Database, rules: Dict = SEASON_RULES):
+        super().__init__()
+        self.db = db
+        self.rules = rules
+        self._wakeup = asyncio.Event()
+
+    def wake(self):
+        """Проверить переход сразу, не дожидаясь следующего опроса"""
+        self._wakeup.set()
+
+    async def _run(self, bot: Bot):
+        while True:
+            try:
+                state = await self.db.get_season_rollover()
+                if state:
+                    players = await self.rollover(state['season'], state['cursor'])
+                    logger.info(f"Сезон {state['season']} завершён, в архиве {players} игроков")
+                    if state['admin_id']:
+                        await self._notify(bot, state['admin_id'], state['season'], players)
+            except Exception as e:
+                logger.error(f"Ошибка при переходе сезона: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), SEASON_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def rollover(self, season: int, cursor: int = 0) -> int:
+        """Заархивировать сезон порциями, начиная после пользователя cursor"""
+        cards = cards_by_rule(self.rules)
+        while True:
+            last_user_id = await self.db.rollover_season_chunk(
+                season, cursor, SEASON_CHUNK_SIZE, self.rules["xp_carry"],
+                cards["reset"], cards["unique"]
+            )
+            if last_user_id is None:
+                break
+            cursor = last_user_id
+            await asyncio.sleep(SEASON_CHUNK_PAUSE)
+
+        return await self.db.finish_season(season)
+
+    async def _notify(self, bot: Bot, admin_id: int, season: int, players: int):
+        try:
+            await bot.send_message(
+                chat_id=admin_id,
+                text=f"🏁 Сезон {season} завершён!\n"
+                     f"Игроков в архиве: {players}\n"
+                     f"Итоги: /leaderboard {season}"
+            )
+        except Exception as e:
+            logger.error(f"Не удалось сообщить о завершении сезона: {e}")
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+from typing import List
+
+from telegram import Bot, Update
+
+from bot import build_application
+from config import BOT_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# Максимальный размер очереди одного обработчика
+WORKER_QUEUE_SIZE = 1000
+
+# Таймаут long polling (в секундах)
+POLLING_TIMEOUT = 30
+
+def get_shard_key(update: Update) -> int:
+    """Получить ключ шардирования обновления (ID пользователя или чата)"""
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return update.update_id
+
+def get_shard(update: Update, workers: int) -> int:
+    """Номер процесса, который обрабатывает обновления этого пользователя"""
+    return get_shard_key(update) % workers
+
+async def _run_worker(index: int, queue: multiprocessing.Queue):
+    """Цикл обработчика: последовательно обрабатывает обновления из своей очереди"""
+    # Фоновые задачи (напоминания и т.п.) выполняет только первый обработчик
+    app = build_application(polling=False, background=index == 0)
+    loop = asyncio.get_running_loop()
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    logger.info(f"Обработчик {index} запущен")
+
+    try:
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            # Обновления одного пользователя всегда попадают в одну очередь
+            # и обрабатываются по одному, поэтому порядок сохраняется
+            await app.process_update(Update.de_json(data, app.bot))
+    finally:
+        await app.stop()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        await app.shutdown()
+        logger.info(f"Обработчик {index} остановлен")
+
+def _worker_main(index: int, queue: multiprocessing.Queue):
+    """Точка входа процесса-обработчика"""
+    # Ctrl+C обрабатывает только диспетчер, он же останавливает обработчики
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # force: при запуске процесса main.py и cards.py уже настроили логирование
+    logging.basicConfig(
+        format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+        force=True
+    )
+    asyncio.run(_run_worker(index, queue))
+
+async def _dispatch(queues: List[multiprocessing.Queue]):
+    """Получать обновления через long polling и раскладывать их по обработчикам"""
+    loop = asyncio.get_running_loop()
+    offset = None
+
+    async with Bot(BOT_TOKEN) as bot:
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=POLLING_TIMEOUT,
+                    read_timeout=POLLING_TIMEOUT + 10,
+                    allowed_updates=Update.ALL_TYPES
+                )
+            except Exception as e:
+                logging.error(f"Ошибка при получении обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                queue = queues[get_shard(update, len(queues))]
+                # put блокируется при переполненной очереди - ждём в отдельном потоке
+                await loop.run_in_executor(None, queue.put, update.to_dict())
+                offset = update.update_id + 1
+
+def run_sharded(workers: int):
+    """Запустить бота в режиме шардирования по нескольким процессам"""
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(workers)]
+    processes = [
+        ctx.Process(target=_worker_main, args=(i, queue), name=f"worker{i}")
+        for i, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    logger.info(f"Диспетчер запущен, обработчиков: {workers}")
+    try:
+        asyncio.run(_dispatch(queues))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
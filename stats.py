@@ -0,0 +1,30 @@
+import asyncio
+import logging
+
+from database import Database
+from tasks import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять устаревшие записи активности (в секундах)
+STATS_PRUNE_INTERVAL = 600
+
+class StatsAggregator(BackgroundTask):
+    """Фоновое обновление сводных таблиц статистики.
+
+    Получения карточек, DAU и популярность карточек считаются сразу при
+    изменении коллекций, поэтому /stats никогда не читает таблицы cards и
+    users. Здесь только удаляются записи активности, уже учтённые в DAU.
+    """
+
+    def __init__(self, db: Database):
+        super().__init__()
+        self.db = db
+
+    async def _run(self):
+        while True:
+            try:
+                await self.db.prune_stats()
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении статистики: {e}")
+            await asyncio.sleep(STATS_PRUNE_INTERVAL)
@@ -0,0 +1,35 @@
+import asyncio
+from typing import Optional
+
+class BackgroundTask:
+    """Фоновая задача бота с запуском и остановкой.
+
+    Наследник реализует корутину _run; аргументы start() (например, bot)
+    передаются в неё. stop() отменяет задачу и дожидается её завершения.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        """Задача запущена и ещё не завершилась"""
+        return self._task is not None and not self._task.done()
+
+    def start(self, *args):
+        """Запустить фоновую задачу"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(*args))
+
+    async def stop(self):
+        """Остановить фоновую задачу"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, *args):
+        raise NotImplementedError
@@ -0,0 +1,114 @@
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from cards import CARDS
+from database import Database
+
+# Сколько открытых предложений может быть у одного игрока
+MAX_OPEN_OFFERS = 10
+
+class Offer(NamedTuple):
+    """Открытое предложение обмена: seller отдаёт give_card и хочет want_card"""
+    offer_id: int
+    seller_id: int
+    give_card: str
+    want_card: str
+
+class OrderBook:
+    """Книга заявок на обмен в памяти с индексами по карточке и редкости.
+
+    Источник истины - таблицы trade_offers и trade_journal. Книга догоняет
+    журнал перед каждым чтением, поэтому в режиме шардирования все процессы
+    видят одни и те же предложения.
+    """
+
+    def __init__(self):
+        self.offers: Dict[int, Offer] = {}
+        # Индексы хранят предложения в порядке создания (dict сохраняет порядок вставки)
+        self.by_card: Dict[str, Dict[int, Offer]] = {}
+        self.by_rarity: Dict[str, Dict[int, Offer]] = {}
+        self.by_pair: Dict[Tuple[str, str], Dict[int, Offer]] = {}
+        self.by_seller: Dict[int, Dict[int, Offer]] = {}
+        self.last_seq = 0
+        self._loaded = False
+
+    def _indexes(self, offer: Offer):
+        rarity = CARDS[offer.give_card]['rarity'] if offer.give_card in CARDS else None
+        return (
+            (self.by_card, offer.give_card),
+            (self.by_rarity, rarity),
+            (self.by_pair, (offer.give_card, offer.want_card)),
+            (self.by_seller, offer.seller_id),
+        )
+
+    def add(self, offer: Offer):
+        """Добавить предложение в книгу"""
+        self.offers[offer.offer_id] = offer
+        for index, key in self._indexes(offer):
+            index.setdefault(key, {})[offer.offer_id] = offer
+
+    def remove(self, offer_id: int):
+        """Убрать предложение из книги"""
+        offer = self.offers.pop(offer_id, None)
+        if offer is None:
+            return
+        for index, key in self._indexes(offer):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(offer_id, None)
+                if not bucket:
+                    del index[key]
+
+    async def sync(self, db: Database):
+        """Применить новые записи журнала"""
+        if not self._loaded:
+            offers, self.last_seq = await db.get_open_trade_offers()
+            for row in offers:
+                self.add(Offer(row['offer_id'], row['seller_id'], row['give_card'], row['want_card']))
+            self._loaded = True
+            return
+
+        for event in await db.get_trade_events(self.last_seq):
+            if event['event'] == 'open':
+                self.add(Offer(event['offer_id'], event['seller_id'], event['give_card'], event['want_card']))
+            else:
+                self.remove(event['offer_id'])
+            self.last_seq = event['seq']
+
+    def get(self, offer_id: int) -> Optional[Offer]:
+        """Получить открытое предложение по номеру"""
+        return self.offers.get(offer_id)
+
+    def find(self, card_name: Optional[str] = None, rarity: Optional[str] = None, limit: int = 10) -> List[Offer]:
+        """Найти предложения, в которых отдают указанную карточку или редкость"""
+        if card_name is not None:
+            bucket = self.by_card.get(card_name, {})
+        elif rarity is not None:
+            bucket = self.by_rarity.get(rarity, {})
+        else:
+            bucket = self.offers
+
+        result = []
+        for offer in bucket.values():
+            result.append(offer)
+            if len(result) >= limit:
+                break
+        return result
+
+    def count(self, card_name: Optional[str] = None, rarity: Optional[str] = None) -> int:
+        """Количество предложений по фильтру"""
+        if card_name is not None:
+            return len(self.by_card.get(card_name, {}))
+        if rarity is not None:
+            return len(self.by_rarity.get(rarity, {}))
+        return len(self.offers)
+
+    def find_match(self, give_card: str, want_card: str, seller_id: int) -> Optional[Offer]:
+        """Найти встречное предложение: кто-то отдаёт want_card и хочет give_card"""
+        for offer in self.by_pair.get((want_card, give_card), {}).values():
+            if offer.seller_id != seller_id:
+                return offer
+        return None
+
+    def seller_offers(self, seller_id: int) -> List[Offer]:
+        """Открытые предложения игрока"""
+        return list(self.by_seller.get(seller_id, {}).values())